@@ -12,7 +12,6 @@ from __future__ import (
 from inspect import isclass, getmembers
 from itertools import repeat
 from functools import partial
-from json import JSONEncoder, dumps
 from os import path as p
 
 import config
@@ -23,11 +22,14 @@ from flask import (
     render_template)
 
 from sqlalchemy.exc import IntegrityError, OperationalError
-from flask_sqlalchemy import SQLAlchemy
 from flask_restless import APIManager
 
-from app import helper
+from app import (
+    adjust, api, helper, bulk, cache, counts, export, fx, history, lots,
+    metrics, pool, replicas, series, timing, valuation)
+from app.encoding import APIEncoder, dumps
 from app.frs import Swaggerify
+from app.replicas import SQLAlchemy
 from builtins import *
 
 __version__ = '0.18.0'
@@ -48,11 +50,10 @@ API_EXCEPTIONS = [
     OperationalError]
 
 db = SQLAlchemy()
-swag = Swaggerify()
 
 
 def jsonify(result):
-    response = make_response(dumps(result, cls=CustomEncoder))
+    response = make_response(dumps(result))
     response.headers['Content-Type'] = 'application/json; charset=utf-8'
     response.headers['mimetype'] = 'application/json'
     response.headers['Access-Control-Allow-Origin'] = '*'
@@ -70,12 +71,23 @@ def create_app(config_mode=None, config_file=None):
     else:
         app.config.from_envvar('APP_SETTINGS', silent=True)
 
+    app.json_encoder = APIEncoder
+
     skwargs = {
         'name': __title__, 'version': __version__,
         'description': __description__}
 
-    swag.init_app(app, **skwargs)
+    swag = Swaggerify(app, **skwargs)
+    app.extensions['swagger'] = swag
     db.init_app(app)
+    replicas.init_app(app, db)
+    pool.init_app(app, db)
+    series.init_app(app, db)
+    fx.init_app(app, db)
+    counts.init_app(app)
+    timing.init_app(app)
+    metrics.init_app(app, db)
+    cache.init_app(app)
 
     swag_config = {
         'dom_id': '#swagger-ui',
@@ -115,21 +127,36 @@ def create_app(config_mode=None, config_file=None):
     create_api = partial(mgr.create_api, **kwargs)
     exclude = app.config['SWAGGER_EXCLUDE_COLUMNS']
     create_docs = partial(swag.create_docs, exclude_columns=exclude, **kwargs)
+    create_bulk = partial(
+        bulk.create_blueprint, db, url_prefix=app.config['API_URL_PREFIX'],
+        chunk_size=app.config['API_BULK_CHUNK_SIZE'])
+
+    create_export = partial(
+        export.create_blueprint, db, url_prefix=app.config['API_URL_PREFIX'],
+        chunk_size=app.config['API_EXPORT_CHUNK_SIZE'])
 
     with app.app_context():
         models = helper.get_models()
 
         for table in helper.gen_tables(models):
-            create_api(table)
-            create_docs(table)
+            if table.__tablename__ in app.config['API_READONLY_TABLES']:
+                create_api(table, methods=['GET'])
+                create_docs(table, methods=['GET'])
+            else:
+                create_api(table)
+                create_docs(table)
 
-    return app
+            api.install(app, table)
+            cache.register(app, table)
+            metrics.register(app, table)
+            app.register_blueprint(create_export(table))
 
+            if table.__tablename__ in app.config['API_BULK_TABLES']:
+                app.register_blueprint(create_bulk(table))
 
-class CustomEncoder(JSONEncoder):
-    def default(self, obj):
-        if set(['quantize', 'year']).intersection(dir(obj)):
-            return str(obj)
-        elif set(['next', 'union']).intersection(dir(obj)):
-            return list(obj)
-        return JSONEncoder.default(self, obj)
+        app.register_blueprint(history.create_blueprint(db, **kwargs))
+        app.register_blueprint(valuation.create_blueprint(db, **kwargs))
+
+    swag.freeze()
+
+    return app
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    app.adjust
+    ~~~~~~~~~~
+
+    Provides split and dividend adjusted price series
+
+    Each `Adjustment` row stores the cumulative product of the factors of all
+    of a pair's events on or before its date. A close on date `t` is adjusted
+    by multiplying it by `total / cum(t)`, where `total` is the last stored
+    factor and `cum(t)` the last stored factor on or before `t`. Since the
+    factors accumulate forward in time, an event change on date `d` only
+    rewrites the rows on or after `d`. A price change on date `d` only
+    matters (through the previous close of a dividend) to pairs with events
+    on or after `d`, which are found with a single query.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from array import array
+from bisect import bisect_left
+from operator import mul
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, event, func, or_, select
+
+from app import signals
+from app.bulk import get_default
+from builtins import *
+
+
+def get_split_factor(value, prev_close=None):
+    return 1 / value if value else 1
+
+
+def get_dividend_factor(value, prev_close=None):
+    return 1 - value / prev_close if prev_close else 1
+
+
+# event type name -> (function of (value, previous close), per currency)
+FACTORS = {
+    'Stock Split': (get_split_factor, False),
+    'Dividend': (get_dividend_factor, True),
+    'Special Dividend': (get_dividend_factor, True),
+}
+
+
+def register_factor(name, func, per_currency=True):
+    """Registers the adjustment factor of the event type `name`. `func` is
+    called with the event value and the previous close and returns the
+    factor applied to the closes before the event.
+    """
+    FACTORS[name] = (func, per_currency)
+
+
+def get_base(connection, commodity_id, currency_id, since):
+    """Returns the cumulative factor of the last adjustment before `since`"""
+    from app.models.hermes import Adjustment
+
+    adjs = Adjustment.__table__
+    query = select([adjs.c.factor]).where(and_(
+        adjs.c.commodity_id == commodity_id,
+        adjs.c.currency_id == currency_id, adjs.c.date < since))
+
+    result = connection.execute(query.order_by(adjs.c.date.desc()).limit(1))
+    row = result.first()
+    return row[0] if row else 1
+
+
+def rebuild(connection, commodity_id, currency_id, since=None):
+    """Recomputes the adjustments of a (commodity_id, currency_id) pair on or
+    after `since` (or all of them if `since` is `None`). Returns the list of
+    written adjustment rows.
+    """
+    from app.models.hermes import Adjustment, Event, EventType, Price
+
+    adjs, events, types, prices = (
+        Adjustment.__table__, Event.__table__, EventType.__table__,
+        Price.__table__)
+
+    in_pair = and_(
+        adjs.c.commodity_id == commodity_id, adjs.c.currency_id == currency_id)
+
+    if since is None:
+        connection.execute(adjs.delete().where(in_pair))
+        cum = 1
+    else:
+        connection.execute(adjs.delete().where(
+            and_(in_pair, adjs.c.date >= since)))
+
+        cum = get_base(connection, commodity_id, currency_id, since)
+
+    shared = [name for name, (_, per) in FACTORS.items() if not per]
+
+    # each event's previous close is looked up in the same statement
+    prev_close = select([prices.c.close]).where(and_(
+        prices.c.commodity_id == commodity_id,
+        prices.c.currency_id == currency_id, prices.c.date < events.c.date))
+
+    prev_close = prev_close.order_by(prices.c.date.desc()).limit(1)
+    columns = [events.c.date, events.c.value, types.c.name]
+    query = select(columns + [prev_close.as_scalar()])
+    query = query.select_from(events.join(types)).where(and_(
+        events.c.commodity_id == commodity_id,
+        types.c.name.in_(list(FACTORS)),
+        or_(events.c.currency_id == currency_id, types.c.name.in_(shared))))
+
+    if since is not None:
+        query = query.where(events.c.date >= since)
+
+    new = []
+
+    rows = connection.execute(query.order_by(events.c.date))
+
+    for date, value, name, prev_close in rows:
+        cum *= FACTORS[name][0](value, prev_close)
+
+        if new and new[-1]['date'] == date:
+            new[-1]['factor'] = cum
+        else:
+            new.append({
+                'commodity_id': commodity_id, 'currency_id': currency_id,
+                'date': date, 'factor': cum})
+
+    auto = ['utc_created', 'utc_updated']
+    defaults = dict((col, get_default(adjs.c[col])) for col in auto)
+
+    new = [dict(defaults, **adj) for adj in new]
+
+    if new:
+        connection.execute(adjs.insert(), new)
+
+    return new
+
+
+def get_last_events(connection, commodity_ids):
+    """Returns a dict mapping the (commodity_id, currency_id) pairs of the
+    adjusting events of `commodity_ids` to the date of their last one. The
+    currency of events which apply in every currency is `None`.
+    """
+    from app.models.hermes import Event, EventType
+
+    events, types = Event.__table__, EventType.__table__
+    shared = [name for name, (_, per) in FACTORS.items() if not per]
+    columns = [events.c.commodity_id, events.c.currency_id, types.c.name]
+    query = select(columns + [func.max(events.c.date)])
+    query = query.select_from(events.join(types)).where(and_(
+        events.c.commodity_id.in_(commodity_ids),
+        types.c.name.in_(list(FACTORS))))
+
+    last = {}
+
+    for commodity_id, currency_id, name, date in connection.execute(
+            query.group_by(*columns)):
+        key = (commodity_id, None if name in shared else currency_id)
+        last[key] = max(last.get(key, date), date)
+
+    return last
+
+
+def get_affected(connection, changes):
+    """Returns a dict mapping the (commodity_id, currency_id) pairs affected
+    by the `event` and `price` `changes` to the earliest date from which they
+    must be rebuilt
+    """
+    from app.models.hermes import Price
+
+    prices = Price.__table__
+    affected, changed = {}, {}
+
+    def add(key, date, affected=affected):
+        affected[key] = min(affected.get(key, date), date)
+
+    for row in changes.get('price', []):
+        if row.get('date') is not None:
+            add((row['commodity_id'], row['currency_id']), row['date'], changed)
+
+    # price changes only matter to pairs with events on or after them
+    commodity_ids = set(key[0] for key in changed)
+    last = get_last_events(connection, commodity_ids) if changed else {}
+
+    for (commodity_id, currency_id), date in changed.items():
+        dates = [
+            last.get((commodity_id, currency_id)),
+            last.get((commodity_id, None))]
+
+        if any(d is not None and d >= date for d in dates):
+            add((commodity_id, currency_id), date)
+
+    commodities = {}
+
+    for row in changes.get('event', []):
+        date = row.get('date')
+
+        if date is not None:
+            add((row['commodity_id'], row['currency_id']), date)
+            prev = commodities.get(row['commodity_id'], date)
+            commodities[row['commodity_id']] = min(prev, date)
+
+    # splits apply to the prices of a commodity in every currency
+    for commodity_id, date in commodities.items():
+        query = select([prices.c.currency_id]).distinct().where(
+            prices.c.commodity_id == commodity_id)
+
+        for (currency_id,) in connection.execute(query):
+            add((commodity_id, currency_id), date)
+
+    return affected
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def before_commit(session):
+    from app.models.hermes import Adjustment
+
+    # flush first so that pending ORM changes are recorded alongside those
+    # written by core inserts (e.g., bulk loads)
+    session.flush()
+    changes = signals.get_changes(session)
+
+    if changes.get('event') or changes.get('price'):
+        connection = session.connection()
+        affected = get_affected(connection, changes)
+
+        for (commodity_id, currency_id), since in affected.items():
+            rows = rebuild(connection, commodity_id, currency_id, since)
+            signals.record(session, Adjustment, rows)
+
+
+def query_factors(session, commodity_id, currency_id, start=None, end=None):
+    """Returns a query of the (date, factor) adjustments needed to adjust the
+    closes between `start` and `end`, i.e., from the last one on or before
+    `start` through the latest one
+    """
+    from app.models.hermes import Adjustment
+
+    query = session.query(Adjustment.date, Adjustment.factor).filter(
+        Adjustment.commodity_id == commodity_id,
+        Adjustment.currency_id == currency_id)
+
+    if start:
+        last = query.filter(Adjustment.date <= start).order_by(
+            Adjustment.date.desc()).limit(1).with_entities(Adjustment.date)
+
+        first = last.scalar()
+        query = query.filter(Adjustment.date >= (first or start))
+
+    return query.order_by(Adjustment.date)
+
+
+def apply(dates, closes, adj_dates, factors):
+    """Returns `closes` adjusted by the cumulative `factors`.
+
+    Both `dates` and `adj_dates` must be sorted. The multipliers are laid out
+    one segment (the closes between consecutive adjustments) at a time and
+    then multiplied with the closes in a single pass.
+    """
+    if not factors:
+        return list(closes)
+
+    total = factors[-1]
+    bounds = [bisect_left(dates, date) for date in adj_dates] + [len(dates)]
+    multipliers = array(str('d'), [total] * bounds[0])
+
+    for lo, hi, factor in zip(bounds, bounds[1:], factors):
+        multipliers.extend(array(str('d'), [total / factor]) * (hi - lo))
+
+    return list(map(mul, closes, multipliers))
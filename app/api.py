@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+    app.api
+    ~~~~~~~
+
+    Provides the Flask-Restless API view used by every table
+
+    List (GET many) requests accept `include` (a comma separated list of the
+    relations to return) and `fields[<name>]` (a comma separated list of the
+    columns to return for the table or an included relation). Relations which
+    aren't returned aren't loaded, and included relations are loaded without
+    any of their own relations.
+
+    List requests with a `cursor` parameter (empty for the first page) are
+    paginated by keyset instead of offset. Each page is ordered by the table's
+    keyset columns and starts after the (opaque) `next` cursor of the previous
+    page, so it can be read with a single index seek regardless of its depth.
+
+    Offset paginated responses report how `num_results` was counted (see
+    `app.counts`) in `count_mode`.
+
+    GET responses carry `ETag` and `Last-Modified` headers (see
+    `app.conditional`), and requests whose cached copy is still current are
+    answered with an empty 304 before any of the response is built.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import re
+import json
+
+from math import ceil
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+
+from flask import current_app, g, request
+from flask_restless import ProcessingException
+from flask_restless.helpers import get_relations, strings_to_dates, to_dict
+from flask_restless.views import API as _API
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import (
+    Query, joinedload, load_only, noload, subqueryload)
+from werkzeug.urls import url_encode
+
+from app.conditional import get_headers, get_validators, is_fresh
+from app.counts import get_count
+from builtins import *
+
+FIELDS_REGEX = re.compile(r'^fields\[(\w+)\]$')
+DEF_KEYSET = ['id']
+
+
+def split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def get_loader(model, relation):
+    """Returns the option which loads `relation` (without any of its own
+    relations) alongside `model`. Scalar relations are joined and collections
+    are loaded with a single extra query.
+    """
+    attr = getattr(model, relation)
+    uselist = inspect(model).relationships[relation].uselist
+    loader = subqueryload(attr) if uselist else joinedload(attr)
+    return loader.noload('*')
+
+
+def parse_profile(model, args, default=None):
+    """Returns the (relations, fields) requested in `args`.
+
+    `relations` is `None` if neither `include` nor any `fields` were requested
+    (and there is no `default` profile), otherwise it is the list of relations
+    to return. `fields` maps the table or relation names to their columns.
+    """
+    fields = {}
+
+    for key, value in args.items():
+        match = FIELDS_REGEX.match(key)
+
+        if match:
+            fields[match.group(1)] = split(value)
+
+    if 'include' in args:
+        relations = split(args['include'])
+    elif fields:
+        relations = []
+    else:
+        relations = default
+
+    names = set(get_relations(model))
+    unknown = [r for r in relations or [] if r not in names]
+
+    if unknown:
+        msg = 'Unknown relation(s): {}'.format(', '.join(unknown))
+        raise ProcessingException(description=msg, code=400)
+
+    return relations, fields
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, date) else v for v in values]
+    return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(model, names, cursor):
+    """Returns the keyset column values encoded in `cursor`"""
+    try:
+        values = json.loads(urlsafe_b64decode(str(cursor)).decode('utf-8'))
+        assert len(values) == len(names)
+        return [
+            strings_to_dates(model, {name: value})[name]
+            for name, value in zip(names, values)]
+    except Exception:
+        raise ProcessingException(description='Invalid cursor', code=400)
+
+
+def get_keyset(table):
+    keysets = current_app.config.get('API_KEYSETS', {})
+    return keysets.get(table.__tablename__, DEF_KEYSET)
+
+
+def get_link(**kwargs):
+    """Returns the `Link` header value of the next page, i.e., the request's
+    url updated with `kwargs`
+    """
+    args = dict(request.args.to_dict(), **kwargs)
+    return '<{}?{}>; rel="next"'.format(
+        request.base_url, url_encode(args, sort=True))
+
+
+class API(_API):
+    """A Flask-Restless API which only loads (and returns) the relations and
+    columns requested in list calls
+    """
+    def get(self, instid, relationname, relationinstid):
+        validators = None
+
+        if relationname is None and not request.args.get('callback'):
+            validators = get_validators(self.model, instid)
+
+        if validators and is_fresh(*validators):
+            return {}, 304, get_headers(*validators)
+
+        response = super(API, self).get(instid, relationname, relationinstid)
+
+        # a replica's response may be stale, so it isn't given (current)
+        # validators which would let clients keep it
+        if validators and not g.get('replica'):
+            if not isinstance(response, tuple):
+                response = (response, 200, {})
+            elif len(response) == 2:
+                response += ({},)
+
+            result, status, headers = response
+
+            if status == 200:
+                headers.update(get_headers(*validators))
+
+        return response
+
+    def _paginated(self, instances, deep):
+        # to-many relation GETs (e.g., `/account/1/holdings`) pass a list
+        if not isinstance(instances, Query):
+            return super(API, self)._paginated(instances, deep)
+
+        model, name = self.model, self.model.__tablename__
+        profiles = current_app.config.get('API_INCLUDES', {})
+        default = profiles.get(name)
+        relations, fields = parse_profile(model, request.args, default)
+
+        if relations is None:
+            relations = list(deep)
+        else:
+            deep = dict((r, {}) for r in relations)
+
+        options = [get_loader(model, r) for r in relations]
+        options += [
+            noload(getattr(model, r)) for r in get_relations(model)
+            if r not in deep]
+
+        related = dict((r, fields[r]) for r in relations if r in fields)
+
+        if fields.get(name) is not None or related:
+            self.exclude_columns, self.exclude_relations = None, None
+
+        if fields.get(name) is not None:
+            self.include_columns = fields[name]
+            mapper = inspect(model)
+            columns = set(mapper.column_attrs.keys())
+            keys = [k for k in fields[name] if k in columns]
+
+            # keep the foreign keys needed to load the included relations
+            for relation in relations:
+                prop = mapper.relationships[relation]
+                keys += [c.key for c in prop.local_columns if c.key in columns]
+
+            options.append(load_only(*keys))
+
+        if related:
+            self.include_relations = dict(self.include_relations or {})
+            self.include_relations.update(related)
+
+        instances = instances.options(*options)
+
+        if request.args.get('cursor') is None:
+            return self._offset_paginated(instances, deep)
+        else:
+            return self._keyset_paginated(instances, deep)
+
+    def _to_dicts(self, instances, deep):
+        return [
+            to_dict(
+                x, deep, exclude=self.exclude_columns,
+                exclude_relations=self.exclude_relations,
+                include=self.include_columns,
+                include_relations=self.include_relations,
+                include_methods=self.include_methods)
+            for x in instances]
+
+    def _offset_paginated(self, query, deep):
+        """Returns the requested page of `query` counted according to the
+        table's count mode. An extra row is fetched so that the existence of
+        a next page is known even if the query isn't counted (exactly).
+        """
+        num_results, mode = get_count(self.session, self.model, query)
+        per_page = self._compute_results_per_page()
+
+        if per_page > 0:
+            page_num = int(request.args.get('page', 1))
+            start = (page_num - 1) * per_page
+            instances = query.offset(start).limit(per_page + 1).all()
+            has_next = len(instances) > per_page
+            instances = instances[:per_page]
+        else:
+            page_num, instances, has_next = 1, query.all(), False
+
+        last_page = page_num + 1 if has_next else page_num
+
+        if num_results is not None and per_page > 0:
+            total_pages = int(ceil(num_results / per_page))
+            last_page = max(last_page, total_pages)
+
+        return dict(
+            page=page_num, objects=self._to_dicts(instances, deep),
+            total_pages=last_page, num_results=num_results, count_mode=mode)
+
+    def _keyset_paginated(self, query, deep):
+        """Returns the page of `query` after the request's `cursor` along
+        with the `next` cursor (or `None` if this is the last page)
+        """
+        names = get_keyset(self.model)
+        columns = [getattr(self.model, name) for name in names]
+        cursor = request.args['cursor']
+        query = query.order_by(None).order_by(*columns)
+
+        if cursor:
+            values = decode_cursor(self.model, names, cursor)
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+        per_page = self._compute_results_per_page()
+        instances = query.limit(per_page + 1).all()
+        last = instances[per_page - 1] if len(instances) > per_page else None
+        objects = self._to_dicts(instances[:per_page], deep)
+        next_cursor = last and encode_cursor([getattr(last, n) for n in names])
+        return dict(page=1, objects=objects, total_pages=1, next=next_cursor)
+
+    def _search(self):
+        response = super(API, self)._search()
+        result, headers = response[0], response[-1]
+
+        if len(response) < 3 or 'objects' not in result:
+            pass
+        elif 'next' in result:
+            # replace the page based pagination
+            del result['page'], result['total_pages']
+            next_cursor = result['next']
+            link = get_link(cursor=next_cursor) if next_cursor else ''
+            headers['Link'] = link
+        elif result['count_mode'] == 'none':
+            # the last page is unknown
+            page, last_page = result['page'], result['total_pages']
+            link = get_link(page=page + 1) if last_page > page else ''
+            headers['Link'] = link
+            result['total_pages'] = None
+
+        return response
+
+
+def install(app, table):
+    """Makes the Flask-Restless endpoint of `table` use `API`"""
+    endpoint = '{0}api0.{0}api'.format(table.__tablename__)
+    app.view_functions[endpoint].view_class = API
@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+"""
+    app.bulk
+    ~~~~~~~~
+
+    Provides set-based bulk writes for the app models
+
+    Bulk loads (`POST /<table>/bulk`) skip rows which already exist. Upserts
+    (`PUT /<table>/bulk`) instead overwrite the stored row with the same
+    composite unique key using a native `INSERT .. ON CONFLICT DO UPDATE`
+    (PostgreSQL 9.5+, or SQLite 3.24+). Rows whose values are unchanged aren't
+    written, so neither their `utc_updated` nor the caches are touched. Other
+    databases answer upserts with a 501.
+
+    Both validate each batch set by set rather than row by row on flush: the
+    types and string lengths column by column, and the foreign keys with one
+    `IN` query per referenced table. Errors are reported per row with the
+    `savalidation` (formencode) messages.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from io import StringIO
+from itertools import islice
+from json import loads
+
+from flask import jsonify, request, Blueprint
+from flask_restless.helpers import strings_to_dates
+from sqlalchemy import (
+    UniqueConstraint, DateTime, Date, Float, Integer, Numeric, String, Text,
+    and_, bindparam, or_, select, text)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError, DataError
+
+from app import pool, signals
+from builtins import *
+
+try:
+    # the py2 csv module can't write unicode to an `io.StringIO`
+    from backports import csv
+except ImportError:
+    import csv
+
+NDJSON = 'application/x-ndjson'
+DEF_CHUNK_SIZE = 1000
+
+# the number of key ranges looked up per query (each is k + 1 parameters for a
+# k column unique key, so 200 stay under SQLite's default limit of 999)
+MAX_RANGES = 200
+
+MISSING_MSG = 'Please enter a value'
+DATE_MSG = 'Please enter a date'
+FIELD_MSG = 'Model does not have field'
+EXISTS_MSG = 'Value already exists'
+DUPLICATE_MSG = 'Value is duplicated in batch'
+INTEGER_MSG = 'Please enter an integer value'
+NUMBER_MSG = 'Please enter a number'
+LENGTH_MSG = 'Enter a value less than {} characters long'
+STRING_MSG = 'The input must be a string (not a {}: {!r})'
+FOREIGN_MSG = 'Value does not exist'
+
+SQLITE_UPSERT = (
+    'INSERT INTO {table} ({columns}) VALUES ({params}) ON CONFLICT ({keys}) '
+    'DO UPDATE SET {updates} WHERE {changed}')
+
+
+def gen_chunks(iterable, chunk_size=DEF_CHUNK_SIZE):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
+def loads_rows(text, ndjson=False):
+    """Parses a JSON array or newline delimited JSON into a list of dicts"""
+    text = text.strip()
+
+    if ndjson or not text.startswith('['):
+        rows = [loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        rows = loads(text)
+
+    if not all(isinstance(row, dict) for row in rows):
+        raise ValueError('Each row must be a JSON object')
+
+    return rows
+
+
+def get_unique_columns(table):
+    """Returns the column names of the composite unique constraint of `table`
+    """
+    for constraint in table.__table__.constraints:
+        is_unique = isinstance(constraint, UniqueConstraint)
+
+        if is_unique and len(constraint.columns) > 1:
+            return [column.name for column in constraint.columns]
+
+    return []
+
+
+def get_default(column):
+    """Returns the value of `column`'s python side default (if any)"""
+    default = column.default
+
+    if default is None or default.is_sequence:
+        return None
+    elif default.is_callable:
+        return default.arg(None)
+    else:
+        return default.arg
+
+
+def get_value_columns(table, names):
+    """Returns the names of the columns an upsert of `table` overwrites,
+    i.e., all but the primary, unique (`names`), and auto keys
+    """
+    return [
+        column.name for column in table.__table__.columns
+        if not (column.primary_key or column.name in names or (
+            column.default is not None and column.default.is_callable))]
+
+
+def is_required(column):
+    no_default = column.default is None and column.server_default is None
+    return not (column.nullable or column.primary_key) and no_default
+
+
+def to_date(table, name, value):
+    """Returns the date (or `None`) of the `table` column `name` parsed from
+    `value`, raising a `ValueError` for SQL expressions
+    """
+    value = strings_to_dates(table, {name: value})[name]
+
+    # e.g., 'CURRENT_DATE' is converted to a `func.current_date()`
+    if value is None or isinstance(value, date):
+        return value
+    else:
+        raise ValueError('{} is not a date'.format(value))
+
+
+def prepare_row(table, row):
+    """Converts a JSON row into a dict of column values ready for insertion.
+
+    Returns a tuple of (values, errors) where `errors` maps field names to
+    messages in the same form as the Flask-Restless `validation_errors`.
+    Primary keys are always assigned by the database.
+    """
+    columns = table.__table__.columns
+    values, errors = {}, {}
+
+    for name, value in row.items():
+        if name not in columns:
+            errors[name] = FIELD_MSG
+        elif isinstance(columns[name].type, (Date, DateTime)):
+            try:
+                values[name] = to_date(table, name, value)
+            except (ValueError, TypeError, AttributeError, OverflowError):
+                errors[name] = DATE_MSG
+        else:
+            values[name] = value
+
+    for column in columns:
+        if column.primary_key:
+            values.pop(column.name, None)
+        elif values.get(column.name) is None and is_required(column):
+            errors[column.name] = MISSING_MSG
+        elif column.name not in values:
+            values[column.name] = get_default(column)
+
+    return values, errors
+
+
+def find_keys(session, column, values):
+    """Returns the set of `values` which are stored in `column`"""
+    if values:
+        query = select([column]).where(column.in_(values))
+        return set(r[0] for r in session.execute(query))
+    else:
+        return set()
+
+
+def to_number(value, convert=float):
+    """Returns `value` converted by `convert`, raising a `ValueError` for
+    booleans and values which aren't finite
+    """
+    if isinstance(value, bool):
+        raise ValueError('{} is not a number'.format(value))
+
+    number = convert(value)
+
+    if number != number or number in {float('inf'), float('-inf')}:
+        raise ValueError('{} is not finite'.format(value))
+
+    return number
+
+
+def get_converter(_type):
+    """Returns the (function, error message) converting the numbers of a
+    column of type `_type`
+    """
+    if isinstance(_type, Integer):
+        return int, INTEGER_MSG
+    elif isinstance(_type, Float):
+        return float, NUMBER_MSG
+    elif isinstance(_type, Numeric):
+        return Decimal, NUMBER_MSG
+    else:
+        return None, None
+
+
+def gen_column_errors(column, rows):
+    """Yields the (position, message) of the `rows` whose `column` value is
+    of the wrong type or too long. Numbers are converted in place.
+    """
+    name, _type = column.name, column.type
+    convert, msg = get_converter(_type)
+
+    if convert:
+        for pos, row in enumerate(rows):
+            try:
+                if row[name] is not None:
+                    row[name] = to_number(row[name], convert)
+            except (TypeError, ValueError, InvalidOperation, OverflowError):
+                yield pos, msg
+    elif isinstance(_type, String):
+        for error in gen_string_errors(column, rows):
+            yield error
+
+
+def gen_string_errors(column, rows):
+    """Yields the (position, message) of the `rows` whose (`String`)
+    `column` value isn't a string or is too long
+    """
+    name, _type = column.name, column.type
+    length = None if isinstance(_type, Text) else _type.length
+
+    for pos, row in enumerate(rows):
+        value = row[name]
+
+        if value is None:
+            continue
+        elif not isinstance(value, str):
+            yield pos, STRING_MSG.format(type(value).__name__, value)
+        elif length and len(value) > length:
+            yield pos, LENGTH_MSG.format(length)
+
+
+def validate_rows(session, table, rows):
+    """Returns a dict mapping the positions of the invalid `rows` (prepared
+    column value dicts) to their errors (by field).
+
+    Checks `savalidation.validates_constraints()`'s integer types and string
+    lengths one column at a time, and the existence of foreign keys with one
+    query per referenced column (even if several columns reference it).
+    """
+    errors = defaultdict(dict)
+    references = defaultdict(list)
+    columns = [c for c in table.__table__.columns if not c.primary_key]
+
+    for column in columns:
+        for pos, msg in gen_column_errors(column, rows):
+            errors[pos][column.name] = msg
+
+        for foreign_key in column.foreign_keys:
+            references[foreign_key.column].append(column.name)
+
+    for column, names in references.items():
+        keys = [
+            (pos, name, row[name]) for pos, row in enumerate(rows)
+            for name in names
+            if row[name] is not None and name not in errors[pos]]
+
+        found = find_keys(session, column, set(k[2] for k in keys))
+
+        for pos, name, value in keys:
+            if value not in found:
+                errors[pos][name] = FOREIGN_MSG
+
+    return dict((pos, e) for pos, e in errors.items() if e)
+
+
+def prepare_chunk(session, table, chunk, errors):
+    """Prepares and validates the (position, JSON row) pairs of `chunk`.
+
+    Returns a list of (position, values) of the valid rows, and appends the
+    errors of the rest to `errors`.
+    """
+    prepared = []
+
+    for pos, row in chunk:
+        values, row_errors = prepare_row(table, row)
+
+        if row_errors:
+            errors.append({'index': pos, 'validation_errors': row_errors})
+        else:
+            prepared.append((pos, values))
+
+    _rows = [values for pos, values in prepared]
+    invalid = validate_rows(session, table, _rows) if prepared else {}
+
+    for index, row_errors in sorted(invalid.items()):
+        pos = prepared[index][0]
+        errors.append({'index': pos, 'validation_errors': row_errors})
+
+    return [p for index, p in enumerate(prepared) if index not in invalid]
+
+
+def get_ranges(rows, names):
+    """Returns a dict mapping each prefix (all but the last of the unique
+    `names` key columns) of `rows` to the (min, max) of their last key column
+    """
+    ranges = {}
+
+    for row in rows:
+        prefix, value = tuple(row[name] for name in names[:-1]), row[names[-1]]
+        low, high = ranges.get(prefix, (value, value))
+        ranges[prefix] = (min(low, value), max(high, value))
+
+    return ranges
+
+
+def gen_stored(session, table, rows, names, *columns):
+    """Yields the unique `names` keys (and `columns`) of the stored `table`
+    rows within the key ranges of `rows`, e.g., within the date range of each
+    commodity/currency pair of a batch of prices
+    """
+    keyed = [getattr(table, name) for name in names]
+    ranges = list(get_ranges(rows, names).items())
+
+    for pos in range(0, len(ranges), MAX_RANGES):
+        criteria = [
+            and_(*[c == v for c, v in zip(keyed, prefix)] + [
+                keyed[-1].between(low, high)])
+            for prefix, (low, high) in ranges[pos:pos + MAX_RANGES]]
+
+        query = session.query(*(keyed + list(columns)))
+
+        for row in query.filter(or_(*criteria)):
+            yield row
+
+
+def find_existing(session, table, rows, names):
+    """Returns the set of unique `names` keys of `rows` which are already
+    stored in `table`.
+
+    Uses one range query per chunk (which the composite unique index can
+    satisfy) and filters the superset in python.
+    """
+    return set(gen_stored(session, table, rows, names))
+
+
+def find_values(session, table, rows, names, value_names):
+    """Returns a dict mapping the unique `names` keys of the stored `table`
+    rows (in the range of `rows`) to a tuple of their `value_names` values
+    """
+    columns = [getattr(table, name) for name in value_names]
+    stored = gen_stored(session, table, rows, names, *columns)
+    return dict((r[:len(names)], r[len(names):]) for r in stored)
+
+
+def copy_rows(session, table, rows):
+    """Inserts `rows` with the PostgreSQL COPY command"""
+    names = sorted(rows[0])
+    f = StringIO()
+    writer = csv.writer(f)
+
+    for row in rows:
+        values = (row[name] for name in names)
+        writer.writerow([r'\N' if v is None else v for v in values])
+
+    f.seek(0)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(sql.format(table.__tablename__, ', '.join(names)), f)
+
+
+def insert_rows(session, table, rows, chunk_size=DEF_CHUNK_SIZE):
+    """Inserts prepared `rows` into `table` using multi-row inserts (or COPY
+    with psycopg2). The caller is responsible for committing the session.
+    """
+    bind = session.get_bind(table.__mapper__)
+
+    # psycopg2 doesn't support COPY with a (gevent) wait callback
+    copy = bind.dialect.driver == 'psycopg2' and not pool.is_green(bind)
+    count = 0
+
+    for chunk in gen_chunks(rows, chunk_size):
+        if copy:
+            copy_rows(session, table, chunk)
+        else:
+            session.execute(table.__table__.insert(), chunk)
+
+        count += len(chunk)
+
+    return count
+
+
+def supports_upsert(dialect):
+    """Returns `True` if `dialect`'s database has `ON CONFLICT DO UPDATE`"""
+    if dialect.name == 'postgresql':
+        # the server version is only known once a connection was made
+        return (dialect.server_version_info or (9, 5)) >= (9, 5)
+    elif dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 24)
+    else:
+        return False
+
+
+def get_upsert(table, names, value_names, dialect):
+    """Returns an `INSERT .. ON CONFLICT DO UPDATE` statement of `table`
+    which only updates rows whose `value_names` values differ
+    """
+    if not supports_upsert(dialect):
+        msg = 'Upserts require PostgreSQL 9.5+ or SQLite 3.24+'
+        raise NotImplementedError(msg)
+
+    _table = table.__table__
+    onupdate = [c.name for c in _table.columns if c.onupdate is not None]
+    updated = value_names + onupdate
+
+    if dialect.name == 'postgresql':
+        stmt = pg_insert(_table)
+        set_ = dict((name, stmt.excluded[name]) for name in updated)
+        where = or_(*(
+            _table.c[name].is_distinct_from(stmt.excluded[name])
+            for name in value_names))
+
+        return stmt.on_conflict_do_update(
+            index_elements=names, set_=set_, where=where)
+    elif dialect.name == 'sqlite':
+        # SQLAlchemy 1.1 doesn't compile `ON CONFLICT` for SQLite
+        quote = dialect.identifier_preparer.quote
+        columns = [c for c in _table.columns if not c.primary_key]
+        update = '{0} = excluded.{0}'
+        changed = '{0}.{1} IS NOT excluded.{1}'
+
+        sql = SQLITE_UPSERT.format(
+            table=quote(_table.name),
+            columns=', '.join(quote(c.name) for c in columns),
+            params=', '.join(':{}'.format(c.name) for c in columns),
+            keys=', '.join(map(quote, names)),
+            updates=', '.join(update.format(quote(n)) for n in updated),
+            changed=' OR '.join(
+                changed.format(quote(_table.name), quote(n))
+                for n in value_names))
+
+        # typed params so that values are stored as the ORM stores them
+        params = [bindparam(c.name, type_=c.type) for c in columns]
+        return text(sql).bindparams(*params)
+
+
+def upsert_rows(session, table, rows, names, value_names,
+                chunk_size=DEF_CHUNK_SIZE):
+    """Upserts prepared `rows` into `table`. Returns the number of written
+    rows. The caller is responsible for committing the session.
+    """
+    bind = session.get_bind(table.__mapper__)
+    stmt = get_upsert(table, names, value_names, bind.dialect)
+    count = 0
+
+    for chunk in gen_chunks(rows, chunk_size):
+        count += session.execute(stmt, chunk).rowcount
+
+    return count
+
+
+def load(session, table, rows, chunk_size=DEF_CHUNK_SIZE):
+    """Validates and inserts JSON `rows` into `table` in a single transaction.
+
+    Rows which fail validation or which conflict with the composite unique
+    constraint of `table` are skipped and reported without aborting the batch.
+    Returns a tuple of (number of inserted rows, list of row errors).
+    """
+    names = get_unique_columns(table)
+    seen, errors, valid = set(), [], []
+    key_errors = dict.fromkeys(names, DUPLICATE_MSG)
+
+    for chunk in gen_chunks(enumerate(rows), chunk_size):
+        prepared = prepare_chunk(session, table, chunk, errors)
+
+        if names and prepared:
+            _rows = [values for pos, values in prepared]
+            existing = find_existing(session, table, _rows, names)
+        else:
+            existing = set()
+
+        for pos, values in prepared:
+            key = tuple(values[name] for name in names)
+
+            if key in existing:
+                row_errors = dict.fromkeys(names, EXISTS_MSG)
+            elif names and key in seen:
+                row_errors = key_errors
+            else:
+                seen.add(key)
+                valid.append(values)
+                continue
+
+            errors.append({'index': pos, 'validation_errors': row_errors})
+
+    count = insert_rows(session, table, valid, chunk_size)
+    signals.record(session, table, valid)
+    return count, sorted(errors, key=lambda e: e['index'])
+
+
+def upsert(session, table, rows, chunk_size=DEF_CHUNK_SIZE):
+    """Validates and upserts JSON `rows` into `table` in a single transaction
+    (on the composite unique constraint of `table`).
+
+    Rows which fail validation or which are duplicated in the batch are
+    skipped and reported. Rows which are identical to the stored row aren't
+    written. Returns a tuple of (number of written rows, list of row errors).
+    """
+    names = get_unique_columns(table)
+    value_names = get_value_columns(table, names)
+    seen, errors, changed = set(), [], []
+
+    if not names:
+        raise ValueError('{} has no unique key'.format(table.__tablename__))
+
+    for chunk in gen_chunks(enumerate(rows), chunk_size):
+        prepared = prepare_chunk(session, table, chunk, errors)
+
+        if prepared:
+            _rows = [values for pos, values in prepared]
+            stored = find_values(session, table, _rows, names, value_names)
+        else:
+            stored = {}
+
+        for pos, values in prepared:
+            key = tuple(values[name] for name in names)
+
+            if key in seen:
+                row_errors = dict.fromkeys(names, DUPLICATE_MSG)
+                errors.append({'index': pos, 'validation_errors': row_errors})
+                continue
+
+            seen.add(key)
+
+            if stored.get(key) != tuple(values[n] for n in value_names):
+                changed.append(values)
+
+    count = upsert_rows(session, table, changed, names, value_names, chunk_size)
+    signals.record(session, table, changed)
+    return count, sorted(errors, key=lambda e: e['index'])
+
+
+def create_blueprint(db, table, chunk_size=DEF_CHUNK_SIZE, **kwargs):
+    """Creates a blueprint exposing `POST` (load) and `PUT` (upsert)
+    `/<table>/bulk` endpoints
+    """
+    name = table.__tablename__
+    blueprint = Blueprint('{}bulk'.format(name), __name__)
+    path = '{}/{}/bulk'.format(kwargs.get('url_prefix', ''), name)
+
+    @blueprint.route(path, methods=['POST', 'PUT'])
+    def bulk():
+        content_type = request.headers.get('Content-Type') or ''
+        ndjson = content_type.startswith(NDJSON)
+
+        try:
+            rows = loads_rows(request.get_data(as_text=True), ndjson)
+        except (TypeError, ValueError, OverflowError):
+            response = jsonify(message='Unable to decode data')
+            response.status_code = 400
+            return response
+
+        if request.method == 'PUT' and not supports_upsert(
+                db.session.get_bind(table.__mapper__).dialect):
+            response = jsonify(message='Upserts are not supported')
+            response.status_code = 501
+            return response
+
+        write = upsert if request.method == 'PUT' else load
+
+        try:
+            count, errors = write(db.session, table, rows, chunk_size)
+            db.session.commit()
+        except (IntegrityError, DataError) as e:
+            db.session.rollback()
+            response = jsonify(message=type(e).__name__)
+            response.status_code = 400
+            return response
+
+        result = {
+            'num_results': count, 'num_errors': len(errors), 'errors': errors}
+
+        response = jsonify(result)
+        response.status_code = 200 if request.method == 'PUT' else 201
+        return response
+
+    return blueprint
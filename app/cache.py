@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+    app.cache
+    ~~~~~~~~~
+
+    Provides a write invalidated cache of the Flask-Restless GET responses
+
+    Responses are keyed by path, normalized query string, and the current
+    version of every table the endpoint reads (its own table and those within
+    two relations of it, i.e., everything a nested response may contain). A
+    committed change to a table gives the table a new version, so all of the
+    cached responses which depend on it (directly or through a `backref`)
+    miss from then on and are evicted in due course. Cached responses also
+    expire after `CACHE_TIMEOUT` seconds.
+
+    Versions are stored outside of the worker process (in memcached whenever
+    it's configured or, if it isn't, in a file per table) so that a commit in
+    one gunicorn worker invalidates the responses cached by the others. The
+    versions and memcached responses are namespaced by the database URI so
+    that apps sharing a memcached server (or temp dir) but not a database
+    don't read each other's entries. Since the
+    key is computed before the response is built, a response racing a commit
+    is stored under the stale versions and never served. The versions (and
+    the times they were created) also serve as the conditional GET validators
+    (see `app.conditional`), even if the response cache is disabled.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import os
+
+from time import time
+from timeit import default_timer as timer
+from collections import OrderedDict
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+from threading import RLock
+from uuid import uuid4
+
+from flask import current_app, g, request
+from sqlalchemy import inspect
+from werkzeug.urls import url_encode
+
+from app import signals
+from builtins import *
+
+try:
+    import pylibmc as memcache
+except ImportError:
+    try:
+        import memcache
+    except ImportError:
+        memcache = None
+
+DEF_MAX_ENTRIES = 1024
+DEF_TIMEOUT = 300
+DEF_DEPTH = 2
+
+# response headers which aren't replayed
+SKIP_HEADERS = {'content-length', 'set-cookie'}
+
+
+def new_version():
+    """Returns a unique version which records the time it was created"""
+    return '{:.6f}:{}'.format(time(), uuid4().hex)
+
+
+def get_time(version):
+    """Returns the time (in seconds since the epoch) `version` was created,
+    or the current time for (older) versions which didn't record it
+    """
+    created, sep, token = version.partition(':')
+    return float(created) if sep else time()
+
+
+def get_namespace(app):
+    """Returns the prefix of the shared keys of `app`'s database"""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    return sha1(uri.encode('utf-8')).hexdigest()[:12]
+
+
+def get_tables(table, depth=DEF_DEPTH):
+    """Returns the names of `table` and the tables within `depth` relations
+    of it
+    """
+    tables, models = {table.__tablename__}, [table]
+
+    for _ in range(depth):
+        related = [
+            prop.mapper.class_ for model in models
+            for prop in inspect(model).relationships]
+
+        models = [m for m in related if m.__tablename__ not in tables]
+        tables.update(m.__tablename__ for m in models)
+
+    return tables
+
+
+class LRUBackend(object):
+    """An in-process store of the `max_entries` most recently used
+    responses. Entries expire `timeout` seconds after they're set.
+    """
+    def __init__(self, max_entries=DEF_MAX_ENTRIES, timeout=DEF_TIMEOUT):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            expires, value = self.entries.pop(key, (None, None))
+
+            if value is not None and expires > timer():
+                self.entries[key] = (expires, value)
+            else:
+                value = None
+
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (timer() + self.timeout, value)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class MemcacheBackend(object):
+    """A memcached store of responses shared by all workers"""
+    def __init__(self, client, timeout=DEF_TIMEOUT, namespace=''):
+        self.client = client
+        self.timeout = timeout
+        self.namespace = namespace
+
+    def get(self, key):
+        return self.client.get('{}:response:{}'.format(self.namespace, key))
+
+    def set(self, key, value):
+        key = '{}:response:{}'.format(self.namespace, key)
+        self.client.set(key, value, self.timeout)
+
+    def clear(self):
+        self.client.flush_all()
+
+
+class FileVersions(object):
+    """Table versions stored as files in `dirname` (which must be shared by
+    the workers)
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def _write(self, table, version):
+        # write then rename so readers never see a partial version
+        kwargs = {'dir': self.dirname, 'delete': False, 'mode': 'w'}
+
+        with NamedTemporaryFile(**kwargs) as f:
+            f.write(version)
+
+        os.rename(f.name, os.path.join(self.dirname, table))
+
+    def get(self, tables):
+        versions = {}
+
+        for table in tables:
+            try:
+                with open(os.path.join(self.dirname, table)) as f:
+                    versions[table] = f.read()
+            except (IOError, OSError):
+                versions[table] = None
+
+            if not versions[table]:
+                versions[table] = new_version()
+                self._write(table, versions[table])
+
+        return versions
+
+    def bump(self, tables):
+        for table in tables:
+            self._write(table, new_version())
+
+
+class MemcacheVersions(object):
+    """Table versions stored in memcached"""
+    def __init__(self, client, namespace=''):
+        self.client = client
+        self.namespace = namespace
+
+    def get_key(self, table):
+        return '{}:version:{}'.format(self.namespace, table)
+
+    def get(self, tables):
+        keys = dict((self.get_key(t), t) for t in tables)
+        found = self.client.get_multi(list(keys))
+
+        for key in set(keys).difference(found):
+            # an evicted version must not revert to one seen before
+            self.client.add(key, new_version())
+            found[key] = self.client.get(key)
+
+        return dict((keys[k], v) for k, v in found.items())
+
+    def bump(self, tables):
+        mapping = dict((self.get_key(t), new_version()) for t in tables)
+
+        if mapping:
+            self.client.set_multi(mapping)
+
+
+class ResponseCache(object):
+    """Caches the 200 responses of the registered GET endpoints"""
+    def __init__(self, backend, versions):
+        self.backend = backend
+        self.versions = versions
+        self.endpoints = {}
+
+    def register(self, endpoint, tables):
+        self.endpoints[endpoint] = sorted(tables)
+
+    def get_key(self):
+        tables = self.endpoints[request.endpoint]
+        versions = self.versions.get(tables)
+        args = url_encode(request.args, sort=True)
+        parts = [request.path, args] + [versions[t] for t in tables]
+        return sha1(':'.join(parts).encode('utf-8')).hexdigest()
+
+    def load(self):
+        """Returns the cached response (if any) to the current request"""
+        if request.method != 'GET' or request.endpoint not in self.endpoints:
+            return
+
+        g.cache_key = self.get_key()
+
+        # `no-cache` requests are answered (and cached) afresh
+        if not request.cache_control.no_cache:
+            cached = self.backend.get(g.cache_key)
+        else:
+            cached = None
+
+        if cached is not None:
+            data, headers = cached
+            response = current_app.response_class(data, headers=headers)
+            return response.make_conditional(request)
+
+        # the response will be cached, so it's read from the primary
+        g.replica = None
+
+    def save(self, response):
+        key = g.pop('cache_key', None)
+
+        if key and response.status_code == 200 and not response.is_streamed:
+            headers = [
+                (k, v) for k, v in response.headers
+                if k.lower() not in SKIP_HEADERS]
+
+            self.backend.set(key, (response.get_data(), headers))
+
+        return response
+
+
+def get_client(app):
+    servers = app.config.get('MEMCACHE_SERVERS')
+    use_memcache = app.config.get('DEBUG_MEMCACHE') or not app.debug
+
+    if servers and use_memcache and memcache:
+        return memcache.Client(servers)
+    elif servers and use_memcache:
+        app.logger.warning('memcached is not installed, using local storage')
+
+
+def init_app(app):
+    """Installs the table versions (in memcached if `MEMCACHE_SERVERS` is
+    set) and the response cache of type `CACHE_TYPE` ('memcached', 'lru', or
+    `None` to disable)
+    """
+    cache_type = app.config.get('CACHE_TYPE')
+    timeout = app.config.get('CACHE_TIMEOUT', DEF_TIMEOUT)
+    namespace = get_namespace(app)
+    client = get_client(app)
+
+    if client:
+        versions = MemcacheVersions(client, namespace)
+    else:
+        dirname = app.config['CACHE_VERSIONS_DIR']
+        versions = FileVersions(os.path.join(dirname, namespace))
+
+    app.extensions['versions'] = versions
+    signals.connect(app, versions.bump)
+
+    if client and cache_type == 'memcached':
+        backend = MemcacheBackend(client, timeout, namespace)
+    elif cache_type:
+        max_entries = app.config.get('CACHE_MAX_ENTRIES', DEF_MAX_ENTRIES)
+        backend = LRUBackend(max_entries, timeout)
+    else:
+        return
+
+    cache = ResponseCache(backend, versions)
+    app.extensions['cache'] = cache
+    app.before_request(cache.load)
+    app.after_request(cache.save)
+    return cache
+
+
+def register(app, table):
+    """Caches the responses of the Flask-Restless endpoint of `table`"""
+    cache = app.extensions.get('cache')
+
+    if cache:
+        endpoint = '{0}api0.{0}api'.format(table.__tablename__)
+        cache.register(endpoint, get_tables(table))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    app.conditional
+    ~~~~~~~~~~~~~~~
+
+    Provides conditional GET validators derived from the table versions
+
+    A response's validators come from the current versions (see `app.cache`)
+    of its table and of the tables within two relations of it (i.e., those
+    of any embedded rows), along with the request's path and query string.
+    Since every committed write, delete included, gives its tables new
+    versions, the validators cost no queries at all.
+
+    `Last-Modified` is the (whole second) time the newest of those versions
+    was created. It's only sent once that second has passed, so a later
+    version always has a later `Last-Modified`.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from datetime import datetime as dt
+from hashlib import sha1
+from time import time
+
+from flask import current_app, request
+from werkzeug.http import http_date, quote_etag
+
+from app.cache import get_tables, get_time
+from builtins import *
+
+
+def get_validators(table, instid=None):
+    """Returns the tuple (etag, last modified) of a `table` resource (or of
+    the collection if `instid` is `None`). `last modified` is `None` if the
+    newest version was created within the current second. Returns `None` if
+    the app has no table versions.
+    """
+    store = current_app.extensions.get('versions')
+
+    if not store:
+        return None
+
+    tables = sorted(get_tables(table))
+    versions = store.get(tables)
+    query_string = request.query_string.decode('utf-8')
+    parts = [table.__tablename__, instid, query_string]
+    parts += [versions[t] for t in tables]
+    content = ':'.join(map(str, parts)).encode('utf-8')
+    modified = int(max(get_time(v) for v in versions.values()))
+
+    if modified < int(time()):
+        last_modified = dt.utcfromtimestamp(modified)
+    else:
+        last_modified = None
+
+    return sha1(content).hexdigest(), last_modified
+
+
+def is_fresh(etag, last_modified):
+    """Returns `True` if the client's cached copy (as described by the request's
+    `If-None-Match` or `If-Modified-Since` headers) is still current
+    """
+    if request.if_none_match:
+        return etag in request.if_none_match
+    elif request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    else:
+        return False
+
+
+def get_headers(etag, last_modified):
+    headers = {'ETag': quote_etag(etag)}
+
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+
+    return headers
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+    app.counts
+    ~~~~~~~~~~
+
+    Provides the `num_results` counts of list queries
+
+    Each table is counted in one of the following modes:
+
+    - exact: a `COUNT(*)` of the filtered query
+    - cached: an exact count cached for `API_COUNT_TTL` seconds (or until the
+      table is written to). At most `API_COUNT_MAX_ENTRIES` (the most
+      recently used) counts are kept.
+    - estimated: the row estimate of the PostgreSQL query planner (exact on
+      other databases)
+    - none: not counted
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from collections import OrderedDict
+from threading import RLock
+from timeit import default_timer as timer
+
+from flask import current_app
+from flask_restless.helpers import count
+
+from app import signals
+from builtins import *
+
+MODES = ['exact', 'cached', 'estimated', 'none']
+DEF_MODE = 'exact'
+DEF_TTL = 60
+DEF_MAX_ENTRIES = 1024
+
+
+def estimate(session, query):
+    """Returns the PostgreSQL planner's row estimate of `query`"""
+    connection = session.connection()
+    statement = query.with_labels().statement
+    compiled = statement.compile(dialect=connection.dialect)
+    sql = 'EXPLAIN (FORMAT JSON) {}'.format(compiled)
+    plan = connection.execute(sql, compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CountCache(object):
+    """A cache of the `max_entries` most recently used exact counts keyed by
+    table and compiled query
+    """
+    def __init__(self, ttl=DEF_TTL, max_entries=DEF_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counts = OrderedDict()
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get_key(self, table, query):
+        compiled = query.with_labels().statement.compile()
+        params = sorted(compiled.params.items())
+        return (table.__tablename__, str(compiled), repr(params))
+
+    def get(self, session, table, query):
+        key = self.get_key(table, query)
+
+        with self.lock:
+            num, expires = self.counts.pop(key, (None, 0))
+
+            if expires >= timer():
+                self.counts[key] = (num, expires)
+                return num
+
+        num = count(session, query)
+
+        with self.lock:
+            self.counts.pop(key, None)
+            self.counts[key] = (num, timer() + self.ttl)
+            self.evict()
+
+        return num
+
+    def evict(self):
+        """Drops the expired counts and then the least recently used ones
+        until at most `max_entries` remain
+        """
+        now = timer()
+        items = self.counts.items()
+        expired = [k for k, (_, expires) in items if expires < now]
+
+        for key in expired:
+            del self.counts[key]
+
+        while len(self.counts) > self.max_entries:
+            self.counts.popitem(last=False)
+
+    def invalidate(self, changes):
+        """Drops the counts of the changed tables"""
+        with self.lock:
+            keys = [key for key in self.counts if key[0] in changes]
+
+            for key in keys:
+                del self.counts[key]
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+
+def init_app(app):
+    ttl = app.config.get('API_COUNT_TTL', DEF_TTL)
+    max_entries = app.config.get('API_COUNT_MAX_ENTRIES', DEF_MAX_ENTRIES)
+    cache = CountCache(ttl, max_entries)
+    app.extensions['counts'] = cache
+    signals.connect(app, cache.invalidate)
+    return cache
+
+
+def get_mode(table):
+    modes = current_app.config.get('API_COUNT_MODES', {})
+    default = current_app.config.get('API_COUNT_MODE', DEF_MODE)
+    return modes.get(table.__tablename__, default)
+
+
+def get_count(session, table, query, mode=None):
+    """Returns the tuple (count, mode used) of `query`"""
+    mode = mode or get_mode(table)
+
+    dialect = session.get_bind().dialect.name
+
+    if mode == 'estimated' and dialect != 'postgresql':
+        mode = 'exact'
+
+    if mode == 'none':
+        num = None
+    elif mode == 'cached':
+        num = current_app.extensions['counts'].get(session, table, query)
+    elif mode == 'estimated':
+        num = estimate(session, query)
+    else:
+        mode, num = 'exact', count(session, query)
+
+    return num, mode
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    app.encoding
+    ~~~~~~~~~~~~
+
+    Provides the JSON encoder used for API responses
+
+    Values json can't natively serialize are looked up by their exact type in
+    `ENCODERS` so encoding a value costs a single dict lookup. `simplejson` (and
+    its C speedups) is used when installed, as Flask itself does.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from datetime import date, datetime, time
+from decimal import Decimal
+from types import GeneratorType
+
+from flask.json import JSONEncoder
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from builtins import *
+
+isoformat = lambda obj: obj.isoformat()
+
+# exact type -> function returning a json serializable value
+ENCODERS = {
+    date: isoformat,
+    datetime: isoformat,
+    time: isoformat,
+    Decimal: str,
+    set: list,
+    frozenset: list,
+    GeneratorType: list,
+    type(map(int, [])): list,
+    type(zip()): list,
+    type(range(0)): list,
+    type({}.keys()): list,
+    type({}.values()): list,
+}
+
+
+def register(_type, func):
+    """Registers `func` as the encoder of values of exactly type `_type`"""
+    ENCODERS[_type] = func
+
+
+def get_encoder(_type):
+    """Returns the encoder of `_type` (or of its nearest registered base class).
+    Subclass lookups are cached in `ENCODERS`.
+    """
+    try:
+        return ENCODERS[_type]
+    except KeyError:
+        base = next((t for t in _type.__mro__[1:] if t in ENCODERS), None)
+
+        if base:
+            ENCODERS[_type] = ENCODERS[base]
+            return ENCODERS[base]
+
+
+class APIEncoder(JSONEncoder):
+    def default(self, obj):
+        encoder = get_encoder(type(obj))
+
+        if encoder:
+            return encoder(obj)
+        elif hasattr(obj, '__iter__'):
+            return list(obj)
+        else:
+            return JSONEncoder.default(self, obj)
+
+
+def dumps(obj, **kwargs):
+    kwargs.setdefault('cls', APIEncoder)
+    return json.dumps(obj, **kwargs)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+    app.export
+    ~~~~~~~~~~
+
+    Provides streaming NDJSON and CSV table exports
+
+    Rows are read as plain column tuples (no ORM objects or relations) from a
+    server-side cursor (where the database driver supports it) one chunk at a
+    time, so memory use doesn't grow with the size of the table.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from datetime import date, time
+from io import StringIO
+
+from flask import Blueprint, Response, request, stream_with_context
+from sqlalchemy import select
+
+from app.encoding import dumps
+from app.helper import error
+from builtins import *
+
+try:
+    # the py2 csv module can't write unicode to an `io.StringIO`
+    from backports import csv
+except ImportError:
+    import csv
+
+DEF_CHUNK_SIZE = 1000
+
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def get_columns(table):
+    return [c.name for c in table.__table__.columns]
+
+
+def gen_rows(session, table, chunk_size=DEF_CHUNK_SIZE):
+    """Yields lists of up to `chunk_size` row tuples of `table` ordered by
+    primary key
+    """
+    columns = table.__table__.columns
+    query = select(list(columns)).order_by(*table.__table__.primary_key)
+    query = query.execution_options(stream_results=True)
+    result = session.execute(query)
+
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            yield rows
+    finally:
+        result.close()
+
+
+def to_text(value):
+    if value is None:
+        return ''
+    elif isinstance(value, (date, time)):
+        return value.isoformat()
+    else:
+        return value
+
+
+def gen_ndjson(columns, chunks):
+    for rows in chunks:
+        lines = (dumps(dict(zip(columns, row))) for row in rows)
+        yield '\n'.join(lines) + '\n'
+
+
+def gen_csv(columns, chunks):
+    f = StringIO()
+    writer = csv.writer(f)
+    writer.writerow(columns)
+
+    for rows in chunks:
+        writer.writerows([to_text(v) for v in row] for row in rows)
+        yield f.getvalue()
+        f.seek(0)
+        f.truncate()
+
+    if f.tell():
+        yield f.getvalue()
+
+
+def gen_export(session, table, fmt='ndjson', chunk_size=DEF_CHUNK_SIZE):
+    """Yields `table` encoded as `fmt` ('ndjson' or 'csv') in chunks"""
+    columns = get_columns(table)
+    chunks = gen_rows(session, table, chunk_size)
+    encode = gen_csv if fmt == 'csv' else gen_ndjson
+    return encode(columns, chunks)
+
+
+def create_blueprint(db, table, chunk_size=DEF_CHUNK_SIZE, **kwargs):
+    """Creates a blueprint exposing a `GET /<table>/export` endpoint which
+    streams the table as NDJSON (the default) or CSV (`format=csv`)
+    """
+    name = table.__tablename__
+    blueprint = Blueprint('{}export'.format(name), __name__)
+    path = '{}/{}/export'.format(kwargs.get('url_prefix', ''), name)
+
+    @blueprint.route(path)
+    def export():
+        fmt = request.args.get('format', 'ndjson')
+
+        if fmt not in MIMETYPES:
+            return error('Unsupported format')
+
+        chunks = gen_export(db.session, table, fmt, chunk_size)
+        response = Response(
+            stream_with_context(chunks), mimetype=MIMETYPES[fmt])
+        filename = '{}.{}'.format(name, fmt)
+        disposition = 'attachment; filename={}'.format(filename)
+        response.headers['Content-Disposition'] = disposition
+        return response
+
+    return blueprint
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+    app.fetch
+    ~~~~~~~~~
+
+    Provides a concurrent price fetcher for the `DataSource` providers
+
+    Each data source (by name) is served by a provider configured in
+    `PRICE_SOURCES`. Every provider is rate limited and retried on failure
+    on its own. Up to `PRICE_WORKERS` symbols are fetched at a time by a
+    thread pool (fetching is I/O bound). The fetched prices are written from
+    the calling thread in batches of `PRICE_CHUNK_SIZE` rows through
+    `app.bulk.load`, so existing prices are skipped and runs are idempotent.
+
+    Syncs are incremental. Each commodity's watermark, i.e., its latest price
+    date (read from the `price` unique index), is kept per currency (and so
+    per data source since each commodity has one). Only the dates after it
+    are requested and commodities which are already current are skipped, so
+    a nightly sync costs as much as the new data. Passing `since` ignores the
+    watermarks to backfill from that date (existing prices are skipped).
+
+    In offline mode every source is served by the file provider, which reads
+    `<symbol>.csv` files (generating missing ones from a seeded random walk)
+    after a simulated network latency. So the whole pipeline runs (and can be
+    benchmarked) without network access.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import os
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from io import StringIO
+from itertools import islice
+from threading import Lock
+from timeit import default_timer as timer
+from zlib import crc32
+
+import requests
+
+from sqlalchemy import func
+
+from app import bulk
+from app.history import get_commodity_id
+from builtins import *
+
+try:
+    # the py2 csv module can't read unicode from an `io.StringIO`
+    from backports import csv
+except ImportError:
+    import csv
+
+DEF_WORKERS = 8
+DEF_TIMEOUT = 10
+DEF_RETRIES = 3
+DEF_BACKOFF = 0.5
+DEF_CHUNK_SIZE = 1000
+DEF_DAYS = 365
+
+
+class FetchError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """A token bucket allowing `rate` calls per second (in bursts of up to
+    `burst` calls)
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = timer()
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = timer()
+            elapsed, self.updated = now - self.updated, now
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+
+
+def parse_csv(text, start=None):
+    """Returns the (date, close) rows (on or after `start`) of csv `text`
+    with `date` and `close` columns (in any case)
+    """
+    rows = []
+
+    for row in csv.DictReader(StringIO(text)):
+        row = dict((k.strip().lower(), v) for k, v in row.items() if k)
+
+        try:
+            day, close = row['date'][:10], float(row['close'])
+        except (KeyError, TypeError, ValueError):
+            raise FetchError('Invalid price row: {}'.format(row))
+
+        if not start or day >= start.isoformat():
+            rows.append((day, close))
+
+    return rows
+
+
+class Provider(object):
+    """The base provider. Subclasses implement `fetch`."""
+    def __init__(self, rate=None, burst=1, timeout=DEF_TIMEOUT, **kwargs):
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self.timeout = timeout
+
+    def fetch(self, symbol, currency, start=None):
+        """Returns a list of (iso date, close) of `symbol` in `currency`"""
+        raise NotImplementedError
+
+    def get(self, symbol, currency, start=None):
+        if self.limiter:
+            self.limiter.wait()
+
+        return self.fetch(symbol, currency, start)
+
+
+class HTTPProvider(Provider):
+    """Fetches the csv at `url` (formatted with `symbol`, `currency` and
+    `start`)
+    """
+    def __init__(self, url=None, **kwargs):
+        super(HTTPProvider, self).__init__(**kwargs)
+        self.url = url
+        self.session = requests.Session()
+
+    def fetch(self, symbol, currency, start=None):
+        if not self.url:
+            raise FetchError('No url configured')
+
+        start_date = start.isoformat() if start else ''
+        kwargs = {'symbol': symbol, 'currency': currency, 'start': start_date}
+        url = self.url.format(**kwargs)
+
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            raise FetchError(str(e))
+
+        return parse_csv(r.text, start)
+
+
+def gen_fake(symbol, days=DEF_DAYS, end=None):
+    """Yields the (iso date, close) of a random walk seeded by `symbol`"""
+    rand = random.Random(crc32(symbol.encode('utf-8')))
+    end = end or date.today()
+    close = rand.uniform(10, 200)
+
+    for offset in range(days, 0, -1):
+        close = max(close * rand.gauss(1, 0.015), 0.01)
+        yield ((end - timedelta(days=offset)).isoformat(), round(close, 2))
+
+
+class FileProvider(Provider):
+    """Reads `<dirname>/<symbol>.csv` files after sleeping `latency` seconds
+    (to simulate a network call). Missing files are generated.
+    """
+    def __init__(self, dirname=None, latency=0, **kwargs):
+        super(FileProvider, self).__init__(**kwargs)
+        self.dirname = dirname
+        self.latency = latency
+        self.lock = Lock()
+
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def write(self, symbol, path):
+        with self.lock:
+            with open(path, 'w') as f:
+                f.write('date,close\n')
+                f.writelines('{},{}\n'.format(*row) for row in gen_fake(symbol))
+
+    def fetch(self, symbol, currency, start=None):
+        path = os.path.join(self.dirname, '{}.csv'.format(symbol))
+
+        if not os.path.exists(path):
+            self.write(symbol, path)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with open(path) as f:
+            return parse_csv(f.read(), start)
+
+
+PROVIDERS = {'http': HTTPProvider, 'file': FileProvider}
+
+
+def register_provider(name, cls):
+    """Adds a provider class which can be used in `PRICE_SOURCES`"""
+    PROVIDERS[name] = cls
+
+
+def get_providers(config, offline=False):
+    """Returns a dict mapping the data source names to their providers"""
+    sources = config.get('PRICE_SOURCES', {})
+    timeout = config.get('PRICE_TIMEOUT', DEF_TIMEOUT)
+    fake = {
+        'provider': 'file', 'dirname': config.get('PRICE_FAKE_DIR'),
+        'latency': config.get('PRICE_FAKE_LATENCY', 0)}
+
+    providers = {}
+
+    for name, options in sources.items():
+        options = dict(options, **fake) if offline else dict(options)
+        options.setdefault('timeout', timeout)
+        providers[name] = PROVIDERS[options.pop('provider', 'http')](**options)
+
+    return providers
+
+
+def get_last_close(today=None):
+    """Returns the date of the latest (weekday) close before `today`"""
+    day = (today or date.today()) - timedelta(days=1)
+
+    while day.weekday() > 4:
+        day -= timedelta(days=1)
+
+    return day
+
+
+def query_tasks(session, currency_id, symbols=None):
+    """Returns a query of the (commodity id, symbol, data source name,
+    watermark) of the commodities to price in `currency_id`
+    """
+    from app.models.hermes import Commodity, DataSource, Price
+
+    watermarks = session.query(
+        Price.commodity_id, func.max(Price.date).label('watermark'))
+
+    watermarks = watermarks.filter(Price.currency_id == currency_id)
+    watermarks = watermarks.group_by(Price.commodity_id).subquery()
+
+    query = session.query(
+        Commodity.id, Commodity.symbol, DataSource.name,
+        watermarks.c.watermark)
+
+    query = query.join(DataSource, Commodity.data_source_id == DataSource.id)
+    query = query.outerjoin(
+        watermarks, Commodity.id == watermarks.c.commodity_id)
+
+    query = query.filter(Commodity.id != currency_id)
+
+    if symbols:
+        query = query.filter(Commodity.symbol.in_(symbols))
+
+    return query.order_by(Commodity.id)
+
+
+def gen_tasks(rows, since=None, end=None):
+    """Yields the (commodity id, symbol, data source name, start) of the
+    `query_tasks` rows whose watermark is before `end`
+    """
+    end = end or get_last_close()
+
+    for commodity_id, symbol, source, watermark in rows:
+        if since:
+            start = since
+        elif watermark:
+            start = watermark.date() + timedelta(days=1)
+        else:
+            start = None
+
+        if not start or start <= end:
+            yield (commodity_id, symbol, source, start)
+
+
+def fetch_one(provider, symbol, currency, start=None, retries=DEF_RETRIES,
+              backoff=DEF_BACKOFF):
+    """Returns `provider`'s prices of `symbol`, retrying failures with an
+    exponential backoff
+    """
+    for attempt in range(retries + 1):
+        try:
+            return provider.get(symbol, currency, start)
+        except FetchError:
+            if attempt == retries:
+                raise
+
+            time.sleep(backoff * 2 ** attempt)
+
+
+def gen_fetched(tasks, providers, currency, workers=DEF_WORKERS, **kwargs):
+    """Yields a (task, rows, error) tuple per fetched task. No more than
+    `workers * 2` tasks are queued at a time.
+    """
+    tasks = iter(tasks)
+
+    def submit(executor, task):
+        commodity_id, symbol, source, start = task
+        provider = providers.get(source)
+
+        if provider:
+            args = (provider, symbol, currency, start)
+            return executor.submit(fetch_one, *args, **kwargs)
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {}
+
+        while True:
+            for task in islice(tasks, workers * 2 - len(pending)):
+                future = submit(executor, task)
+
+                if future:
+                    pending[future] = task
+                else:
+                    yield task, [], 'No provider for {}'.format(task[2])
+
+            if not pending:
+                break
+
+            future = next(as_completed(pending))
+            task = pending.pop(future)
+
+            # one provider's failure mustn't stop the others' batches
+            try:
+                rows, error = future.result(), None
+            except Exception as e:
+                rows, error = [], str(e) or type(e).__name__
+
+            yield task, rows, error
+
+
+def fetch_prices(session, providers, currency, symbols=None, since=None,
+                 end=None, workers=DEF_WORKERS, chunk_size=DEF_CHUNK_SIZE,
+                 **kwargs):
+    """Fetches the new `currency` prices (or those on or after `since`) of
+    (the `symbols` of) every commodity which isn't current as of `end`, and
+    stores them in batches. Returns a summary dict.
+    """
+    from app.models.hermes import Price
+
+    currency_id = get_commodity_id(session, currency)
+
+    if not currency_id:
+        raise FetchError('Unknown currency {}'.format(currency))
+
+    results = query_tasks(session, currency_id, symbols).all()
+    tasks = list(gen_tasks(results, since, end))
+    summary = {
+        'symbols': len(tasks), 'current': len(results) - len(tasks),
+        'fetched': 0, 'inserted': 0, 'skipped': 0, 'errors': {}}
+
+    start_time, rows = timer(), []
+
+    def write(rows):
+        count, errors = bulk.load(session, Price, rows, chunk_size)
+        session.commit()
+        summary['inserted'] += count
+        summary['skipped'] += len(errors)
+
+    fetched = gen_fetched(tasks, providers, currency, workers, **kwargs)
+
+    for (commodity_id, symbol, source, start), prices, error in fetched:
+        if error:
+            summary['errors'][symbol] = error
+            continue
+
+        summary['fetched'] += len(prices)
+        rows.extend(
+            {
+                'commodity_id': commodity_id, 'currency_id': currency_id,
+                'date': day, 'close': close}
+            for day, close in prices)
+
+        if len(rows) >= chunk_size:
+            write(rows)
+            rows = []
+
+    if rows:
+        write(rows)
+
+    summary['elapsed'] = timer() - start_time
+    return summary
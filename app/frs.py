@@ -12,7 +12,13 @@ import re
 import json
 import yaml
 
-from flask import jsonify, request, Blueprint, redirect
+from collections import OrderedDict
+from copy import deepcopy
+from gzip import GzipFile
+from hashlib import sha1
+from io import BytesIO
+
+from flask import jsonify, request, Blueprint, redirect, make_response
 
 try:
     from flask_restless.helpers import get_related_model
@@ -55,22 +61,39 @@ JSON_TYPES = {
     'password': 'string',
 }
 
+# the number of hosts whose serialized specs are cached
+MAX_HOSTS = 16
+
+DEF_SWAGGER = {
+    'swagger': '2.0',
+    'info': {},
+    'tags': [],
+    'schemes': ['http', 'https'],
+    'basePath': '/',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'paths': {},
+    'definitions': {}
+}
 
-class Swaggerify(object):
-    swagger = {
-        'swagger': '2.0',
-        'info': {},
-        'tags': [],
-        'schemes': ['http', 'https'],
-        'basePath': '/',
-        'consumes': ['application/json'],
-        'produces': ['application/json'],
-        'paths': {},
-        'definitions': {}
-    }
 
+def gzip(content):
+    # a fixed mtime keeps the output (and therefore the ETag) deterministic
+    f = BytesIO()
+
+    with GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+        gz.write(content)
+
+    return f.getvalue()
+
+
+class Swaggerify(object):
     def __init__(self, app=None, **kwargs):
         self.app = None
+        self.swagger = deepcopy(DEF_SWAGGER)
+        self.exclude_columns = set()
+        self.frozen = False
+        self.cache = OrderedDict()
 
         if app is not None:
             self.init_app(app, **kwargs)
@@ -84,6 +107,36 @@ class Swaggerify(object):
     def __str__(self):
         return self.to_json(indent=4)
 
+    def freeze(self):
+        """Marks the spec as complete so that its serialization is cached"""
+        self.frozen = True
+
+    def thaw(self):
+        self.frozen = False
+        self.cache = OrderedDict()
+
+    def serialize(self, host):
+        """Returns the (json bytes, gzipped json bytes, etag) of the spec as
+        served from `host`. The `Host` header is client controlled, so only the
+        `MAX_HOSTS` most recently used hosts are cached.
+        """
+        host = host.lower()
+        serialized = self.cache.pop(host, None)
+
+        if serialized is None:
+            spec = dict(self.swagger, host=host)
+            content = json.dumps(spec, sort_keys=True).encode('utf-8')
+            etag = sha1(content).hexdigest()
+            serialized = (content, gzip(content), etag)
+
+        if self.frozen:
+            self.cache[host] = serialized
+
+            while len(self.cache) > MAX_HOSTS:
+                self.cache.popitem(last=False)
+
+        return serialized
+
     @property
     def tags(self):
         return set(tag['name'] for tag in self.swagger['tags'])
@@ -276,12 +329,31 @@ class Swaggerify(object):
         @swagger.route('/swagger.json')
         def swagger_json():
             # Must have a request context
-            self.swagger['host'] = urlparse.urlparse(request.url_root).netloc
-            return jsonify(self.swagger)
+            host = urlparse.urlparse(request.url_root).netloc
+            content, gzipped, etag = self.serialize(host)
+            encoded = 'gzip' in request.accept_encodings
+
+            # each encoding is a distinct representation with its own ETag
+            if encoded:
+                etag = '{}-gzip'.format(etag)
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            elif encoded:
+                response = make_response(gzipped)
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                response = make_response(content)
+
+            response.headers['Content-Type'] = 'application/json'
+            response.set_etag(etag)
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
 
         app.register_blueprint(swagger)
 
     def create_docs(self, table, **kwargs):
+        self.thaw()
         self.exclude_columns = set(kwargs.get('exclude_columns', []))
         self.add_defn(table)
         self.add_defn(table, flat=True)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+    app.fx
+    ~~~~~~
+
+    Provides currency conversion over the latest currency `Price` rows
+
+    A `Price` of commodity `a` in currency `b` is an edge `a -> b` (and its
+    inverse `b -> a`) of a rate graph whose nodes are the commodities of the
+    'Currency' group. Conversions follow the path with the fewest hops.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from collections import defaultdict, deque
+from threading import RLock
+from timeit import default_timer as timer
+
+from flask import current_app
+from sqlalchemy import and_, func
+
+from app import signals
+from app.replicas import use_primary
+from builtins import *
+
+CURRENCY_GROUP = 'Currency'
+DEF_TTL = 300
+
+
+def query_currency_ids(session):
+    from app.models.hermes import Commodity, CommodityGroup, CommodityType
+
+    query = session.query(Commodity.id)
+    query = query.join(CommodityType, Commodity.type_id == CommodityType.id)
+    query = query.join(
+        CommodityGroup, CommodityType.group_id == CommodityGroup.id)
+
+    return query.filter(CommodityGroup.name == CURRENCY_GROUP)
+
+
+def query_rates(session):
+    """Returns a query of the latest (commodity_id, currency_id, close) price
+    of each pair of currencies
+    """
+    from app.models.hermes import Price
+
+    currencies = query_currency_ids(session).subquery()
+    key = [Price.commodity_id, Price.currency_id]
+    latest = session.query(*(key + [func.max(Price.date).label('date')]))
+    latest = latest.filter(
+        Price.commodity_id.in_(currencies), Price.currency_id.in_(currencies))
+
+    latest = latest.group_by(*key).subquery()
+    on_latest = and_(
+        Price.commodity_id == latest.c.commodity_id,
+        Price.currency_id == latest.c.currency_id,
+        Price.date == latest.c.date)
+
+    return session.query(*(key + [Price.close])).join(latest, on_latest)
+
+
+class RateGraph(object):
+    """A graph of conversion rates between currencies.
+
+    Shortest paths are found by breadth first search and cached per
+    (source, target) pair.
+    """
+    def __init__(self, currency_ids=None, rates=None):
+        self.currency_ids = set(currency_ids or [])
+        self.edges = defaultdict(dict)
+        self.paths = {}
+        rates = list(rates or [])
+
+        # direct quotes take precedence over inverted ones
+        for base, quote, close in rates:
+            if close:
+                self.edges[quote][base] = 1 / close
+
+        for base, quote, close in rates:
+            if close:
+                self.edges[base][quote] = close
+
+    def path(self, source, target):
+        """Returns the list of currencies from `source` to `target` (or `None`
+        if they aren't connected)
+        """
+        key = (source, target)
+
+        if key not in self.paths:
+            previous, queue = {source: None}, deque([source])
+
+            while queue and target not in previous:
+                node = queue.popleft()
+
+                for neighbor in self.edges[node]:
+                    if neighbor not in previous:
+                        previous[neighbor] = node
+                        queue.append(neighbor)
+
+            if target in previous:
+                path, node = [], target
+
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+
+                self.paths[key] = path[::-1]
+            else:
+                self.paths[key] = None
+
+        return self.paths[key]
+
+    def rate(self, source, target):
+        """Returns the amount of `target` currency one unit of `source` buys"""
+        path = self.path(source, target)
+
+        if path is not None:
+            rate = 1
+
+            for base, quote in zip(path, path[1:]):
+                rate *= self.edges[base][quote]
+
+            return rate
+
+    def convert(self, amounts, sources, target):
+        """Converts `amounts` denominated in the currencies `sources` (a single
+        currency id or one per amount) to `target`. Amounts which are `None` or
+        can't be converted are returned as `None`.
+        """
+        if not isinstance(sources, (list, tuple)):
+            sources = [sources] * len(amounts)
+
+        rates = dict((s, self.rate(s, target)) for s in set(sources))
+        pairs = zip(amounts, (rates[s] for s in sources))
+        return [None if a is None or r is None else a * r for a, r in pairs]
+
+
+class RateCache(object):
+    """Holds the `RateGraph` built from the latest currency prices. The graph
+    is rebuilt on first access after a committed change to a currency price,
+    or once it's `ttl` seconds old (since other processes' writes aren't
+    signalled).
+    """
+    def __init__(self, db, ttl=DEF_TTL):
+        self.db = db
+        self.ttl = ttl
+        self.graph = None
+        self.expires = 0
+        self.lock = RLock()
+
+    def get(self):
+        with self.lock, use_primary():
+            if self.graph is None or timer() > self.expires:
+                session = self.db.session
+                currency_ids = [r[0] for r in query_currency_ids(session)]
+                self.graph = RateGraph(currency_ids, query_rates(session))
+                self.expires = timer() + self.ttl
+
+            return self.graph
+
+    def invalidate(self, changes):
+        """Drops the graph if any of the changed `price` rows is between two
+        currencies (or if a commodity changed)
+        """
+        with self.lock:
+            graph = self.graph
+
+            if graph is None:
+                return
+
+            ids = graph.currency_ids
+            keys = ['commodity_id', 'currency_id']
+            rows = changes.get('price', [])
+            is_fx = lambda row: all(row.get(k) in ids for k in keys)
+
+            if changes.get('commodity') or any(map(is_fx, rows)):
+                self.graph = None
+
+    def clear(self):
+        with self.lock:
+            self.graph = None
+
+
+def init_app(app, db):
+    cache = RateCache(db, app.config.get('FX_CACHE_TTL', DEF_TTL))
+    app.extensions['fx'] = cache
+    signals.connect(app, cache.invalidate)
+    return cache
+
+
+def get_graph():
+    return current_app.extensions['fx'].get()
@@ -10,6 +10,7 @@ from inspect import isclass, getmembers
 from os import path as p, listdir
 from itertools import repeat
 from json import loads, dumps
+from timeit import default_timer as timer
 
 try:
     from urllib.parse import urlsplit
@@ -18,10 +19,11 @@ except ImportError:
 
 import requests
 
-from flask import current_app as app, url_for
+from flask import current_app as app, url_for, jsonify
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.ext.hybrid import hybrid_property
 
+from app.bulk import load, DEF_CHUNK_SIZE
 from builtins import *
 
 COLUMN_TYPES = (InstrumentedAttribute, hybrid_property)
@@ -31,6 +33,12 @@ DEF_PORT = 5000
 get_json = lambda r: loads(r.get_data(as_text=True))
 
 
+def error(message, status_code=400):
+    response = jsonify(message=message)
+    response.status_code = status_code
+    return response
+
+
 def get_plural(word):
     if word[-1] == 'y':
         return word[:-1] + 'ies'
@@ -146,12 +154,41 @@ def post(table, data, port=DEF_PORT):
     return requests.post(url, data=dumps(data), headers=headers)
 
 
+def get_tables():
+    tables = list(gen_tables(get_models()))
+    return dict(zip(get_table_names(tables), tables))
+
+
 def process(raw):
-    _tables = list(gen_tables(get_models()))
-    tables = dict(zip(get_table_names(_tables), _tables))
+    tables = get_tables()
 
     for data in raw:
         for table, values in data.items():
             columns = get_col_names(tables[table])
-            table_data = [dict(zip(columns, row)) for row in values]
+            table_data = [
+                row if isinstance(row, dict) else dict(zip(columns, row))
+                for row in values]
+
             yield {'table': table, 'data': table_data}
+
+
+def populate(session, raw, chunk_size=DEF_CHUNK_SIZE):
+    """Inserts `get_init_data()`-style data directly through the session's
+    engine, table by table in the order given.
+
+    Yields a summary dict per table (including the elapsed seconds). The
+    session is committed once all tables have been loaded.
+    """
+    tables = get_tables()
+
+    for piece in process(raw):
+        start = timer()
+        table = tables[piece['table']]
+        count, errors = load(session, table, piece['data'], chunk_size)
+        elapsed = timer() - start
+
+        yield {
+            'table': piece['table'], 'count': count, 'errors': errors,
+            'elapsed': elapsed}
+
+    session.commit()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+    app.history
+    ~~~~~~~~~~~
+
+    Provides column oriented price and event history endpoints
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from flask import jsonify, request, Blueprint
+from flask_restless.helpers import strings_to_dates
+
+from app.adjust import apply, query_factors
+from app.helper import error
+from builtins import *
+
+
+def get_commodity_id(session, symbol=None, commodity_id=None):
+    from app.models.hermes import Commodity
+
+    if commodity_id:
+        return int(commodity_id)
+    elif symbol:
+        query = session.query(Commodity.id).filter(Commodity.symbol == symbol)
+        result = query.first()
+        return result[0] if result else None
+
+
+def query_history(session, table, columns, commodity_id, currency_id,
+                  start=None, end=None):
+    """Returns a column-only query of `table` for a single commodity/currency
+    pair ordered by date.
+
+    The filters match the leading columns of the `(commodity_id, currency_id,
+    date)` index so the query compiles to a single range scan and no ORM
+    objects (or joined relations) are built.
+    """
+    query = session.query(table.date, *columns).filter(
+        table.commodity_id == commodity_id, table.currency_id == currency_id)
+
+    if start:
+        query = query.filter(table.date >= start)
+
+    if end:
+        query = query.filter(table.date <= end)
+
+    return query.order_by(table.date)
+
+
+def parse_args(session, table, args):
+    """Returns the history query kwargs from the request `args`"""
+    commodity_id = get_commodity_id(
+        session, args.get('symbol'), args.get('commodity_id'))
+
+    currency_id = get_commodity_id(
+        session, args.get('currency'), args.get('currency_id'))
+
+    dates = dict((k, args[k]) for k in ['start', 'end'] if args.get(k))
+
+    # resolve date-strings using the model's column type
+    for key, value in dates.items():
+        dates[key] = strings_to_dates(table, {'date': value})['date']
+
+    return dict(commodity_id=commodity_id, currency_id=currency_id, **dates)
+
+
+def create_blueprint(db, **kwargs):
+    """Creates a blueprint exposing the `GET /price/history` and
+    `GET /event/history` endpoints.
+
+    Both accept either `symbol` and `currency` or `commodity_id` and
+    `currency_id`, and optional `start` and `end` dates. Each value column is
+    returned as its own array alongside the `dates` array. Prices also accept
+    `adjusted=true` to return split and dividend adjusted closes and
+    `returns=true` to add the array of (simple) daily returns. Prices are read
+    from the price series cache (see `app.series`).
+    """
+    from app.models.hermes import Price, Event
+    from app.series import from_ordinal, get_series, to_returns
+
+    blueprint = Blueprint('history', __name__)
+    prefix = kwargs.get('url_prefix', '')
+    tables = [
+        (Price, [('closes', Price.close)]),
+        (Event, [('type_ids', Event.type_id), ('values', Event.value)])]
+
+    def add_route(table, fields):
+        names, columns = zip(*fields)
+        path = '{}/{}/history'.format(prefix, table.__tablename__)
+        endpoint = '{}_history'.format(table.__tablename__)
+
+        def history():
+            try:
+                hkwargs = parse_args(db.session, table, request.args)
+            except (ValueError, TypeError, OverflowError):
+                return error('Unable to construct query')
+
+            if not (hkwargs['commodity_id'] and hkwargs['currency_id']):
+                return error('No result found', 404)
+
+            if table is Price:
+                series = get_series(
+                    hkwargs['commodity_id'], hkwargs['currency_id'])
+
+                dates, closes = series.get_slice(
+                    hkwargs.get('start'), hkwargs.get('end'))
+
+                values = [list(map(from_ordinal, dates)), closes]
+            else:
+                query = query_history(db.session, table, columns, **hkwargs)
+                values = list(zip(*query)) or [[]] * (len(names) + 1)
+
+            result = dict(zip(names, map(list, values[1:])))
+            result.update({
+                'commodity_id': hkwargs['commodity_id'],
+                'currency_id': hkwargs['currency_id'],
+                'num_results': len(values[0]),
+                'dates': [date.isoformat() for date in values[0]]})
+
+            if table is Price and request.args.get('adjusted') == 'true':
+                factors = query_factors(db.session, **hkwargs).all()
+                adj_dates, adj_factors = list(zip(*factors)) or [[], []]
+                result['closes'] = apply(
+                    values[0], result['closes'], adj_dates, adj_factors)
+
+            if table is Price and request.args.get('returns') == 'true':
+                result['returns'] = list(to_returns(result['closes']))
+
+            return jsonify(result)
+
+        blueprint.add_url_rule(path, endpoint, history)
+
+    for table, fields in tables:
+        add_route(table, fields)
+
+    return blueprint
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    app.lots
+    ~~~~~~~~
+
+    Provides the incremental tax lot (cost basis) engine
+
+    Each `Lot` row is a number of shares bought by one transaction (the open
+    transaction) and, once matched against a sale, closed by another (the close
+    transaction). Partially sold lots are split into a closed and an open row.
+
+    The lots of each affected holding are replayed just before a commit from
+    the recorded `Transaction` changes (see `app.signals`), so transactions
+    written by core inserts (e.g., bulk loads) are matched as well as those
+    flushed by the ORM.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from operator import itemgetter
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, case, event, func, or_, select
+
+from app import signals
+from app.bulk import get_default
+from builtins import *
+
+EPSILON = 1e-9
+DEF_METHOD = 'fifo'
+
+# method name -> (sort key of open lots, reverse)
+METHODS = {
+    'fifo': (itemgetter('open_date', 'open_trxn_id'), False),
+    'lifo': (itemgetter('open_date', 'open_trxn_id'), True),
+    'hifo': (itemgetter('open_price', 'open_date'), True),
+}
+
+
+def register_method(name, key, reverse=False):
+    """Registers a lot matching method which sells open lots in the order
+    given by sorting them (as dicts) with `key`
+    """
+    METHODS[name] = (key, reverse)
+
+
+def get_method():
+    if has_app_context():
+        return current_app.config.get('LOT_METHOD', DEF_METHOD)
+    else:
+        return DEF_METHOD
+
+
+def match(lots, trxns, method=DEF_METHOD):
+    """Matches sell `trxns` against open `lots` (and the lots opened by buy
+    `trxns`). Returns a tuple of (open lots, closed lots).
+
+    Shares sold in excess of the open lots are ignored.
+    """
+    key, reverse = METHODS[method]
+    opened, closed = list(lots), []
+
+    for trxn in trxns:
+        if trxn['type'] == 'Buy':
+            opened.append({
+                'holding_id': trxn['holding_id'], 'open_trxn_id': trxn['id'],
+                'shares': trxn['shares'], 'open_date': trxn['date'],
+                'open_price': trxn['price']})
+        elif trxn['type'] == 'Sell':
+            remaining = trxn['shares']
+
+            for lot in sorted(opened, key=key, reverse=reverse):
+                if remaining < EPSILON:
+                    break
+
+                shares = min(lot['shares'], remaining)
+                lot['shares'] -= shares
+                remaining -= shares
+                closed.append(dict(
+                    lot, shares=shares, close_trxn_id=trxn['id'],
+                    close_date=trxn['date'], close_price=trxn['price']))
+
+            opened = [lot for lot in opened if lot['shares'] >= EPSILON]
+
+    return opened, closed
+
+
+def merge(lots):
+    """Combines the open `lots` which were split from the same buy"""
+    merged = {}
+
+    for lot in lots:
+        trxn_id = lot['open_trxn_id']
+
+        if trxn_id in merged:
+            merged[trxn_id]['shares'] += lot['shares']
+        else:
+            merged[trxn_id] = lot
+
+    return list(merged.values())
+
+
+def replay(connection, holding_id, since=None, method=DEF_METHOD):
+    """Rebuilds the lots of a holding from the transactions on or after
+    `since` (or from all of them if `since` is `None`).
+
+    Lots opened before `since` are kept; any of their shares closed on or
+    after `since` are reopened before the later transactions are replayed.
+    Returns the list of written lot rows.
+    """
+    from app.models.cronus import Lot, Transaction, TrxnType
+
+    lots, trxns = Lot.__table__, Transaction.__table__
+    in_holding = lots.c.holding_id == holding_id
+
+    if since is None:
+        connection.execute(lots.delete().where(in_holding))
+        opened = []
+    else:
+        # lots opened on or after `since` are rebuilt from scratch
+        is_new = and_(in_holding, lots.c.open_date >= since)
+        connection.execute(lots.delete().where(is_new))
+
+        reopen = and_(in_holding, or_(
+            lots.c.close_date.is_(None), lots.c.close_trxn_id.is_(None),
+            lots.c.close_date >= since))
+
+        columns = [
+            lots.c.holding_id, lots.c.open_trxn_id, lots.c.shares,
+            lots.c.open_date, lots.c.open_price]
+
+        rows = connection.execute(select(columns).where(reopen))
+        opened = merge(dict(row) for row in rows)
+        connection.execute(lots.delete().where(reopen))
+
+    query = select([
+        trxns.c.id, trxns.c.holding_id, trxns.c.shares, trxns.c.price,
+        trxns.c.date, TrxnType.__table__.c.name.label('type')])
+
+    query = query.select_from(trxns.join(TrxnType.__table__)).where(
+        trxns.c.holding_id == holding_id)
+
+    if since is not None:
+        query = query.where(trxns.c.date >= since)
+
+    query = query.order_by(trxns.c.date, trxns.c.id)
+    trxn_rows = [dict(row) for row in connection.execute(query)]
+    opened, closed = match(opened, trxn_rows, method)
+    new = closed + opened
+
+    defaults = {'close_trxn_id': None, 'close_date': None, 'close_price': None}
+
+    for col in ['utc_created', 'utc_updated']:
+        defaults[col] = get_default(lots.c[col])
+
+    new = [dict(defaults, **lot) for lot in new]
+
+    if new:
+        connection.execute(lots.insert(), new)
+
+    return new
+
+
+def get_affected(rows):
+    """Returns a dict mapping the holding ids of the changed transaction
+    `rows` to the earliest date from which they must be replayed
+    """
+    affected = {}
+
+    for row in rows:
+        holding_id, date = row.get('holding_id'), row.get('date')
+
+        if holding_id is not None and date is not None:
+            affected[holding_id] = min(affected.get(holding_id, date), date)
+
+    return affected
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def before_commit(session):
+    from app.models.cronus import Lot
+
+    # flush first so that pending ORM changes are recorded alongside those
+    # written by core inserts
+    session.flush()
+    rows = signals.get_changes(session).get('transaction')
+
+    if rows:
+        connection = session.connection()
+        method = get_method()
+
+        for holding_id, since in get_affected(rows).items():
+            lots = replay(connection, holding_id, since, method)
+            signals.record(session, Lot, lots)
+
+
+def query_basis(session, holding_ids):
+    """Returns a query of the open shares, cost basis and realized gain of
+    each of the holdings in `holding_ids` computed from their lots
+    """
+    from app.models.cronus import Lot
+
+    is_open = Lot.close_date.is_(None)
+    realized = Lot.shares * (Lot.close_price - Lot.open_price)
+
+    columns = [
+        Lot.holding_id,
+        func.sum(case([(is_open, Lot.shares)], else_=0)).label('open_shares'),
+        func.sum(case(
+            [(is_open, Lot.shares * Lot.open_price)], else_=0)).label(
+                'cost_basis'),
+        func.sum(case([(is_open, 0)], else_=realized)).label('realized_gain')]
+
+    query = session.query(*columns).filter(Lot.holding_id.in_(holding_ids))
+    return query.group_by(Lot.holding_id)
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+    app.metrics
+    ~~~~~~~~~~~
+
+    Provides request metrics in the Prometheus text format at `/metrics`
+
+    The following are recorded by table (or endpoint for routes which don't
+    serve a table) and method:
+
+    - http_request_duration_seconds: a histogram of request latencies
+    - http_requests_total: a count of requests by status
+    - http_requests_in_flight: the requests being handled
+    - serialization_seconds: a histogram of JSON encoding times
+    - db_pool_checkout_wait_seconds: a histogram of the times requests wait
+      for a pooled connection (including any wait for a free one). It's
+      recorded by `TimedQueuePool`, which `app.replicas.SQLAlchemy` installs
+      in place of SQLAlchemy's default `QueuePool`.
+
+    Each process keeps its own values and writes them to a file in
+    `METRICS_DIR` at most every `METRICS_FLUSH_INTERVAL` seconds (and on
+    every scrape). A scrape sums the files of all the processes, so the
+    gunicorn workers report as one. The files of processes which have exited
+    are folded into `dead.json` (and removed) on startup and on every scrape,
+    so their counters are kept without the files piling up.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import errno
+import fcntl
+import json
+import os
+
+from collections import defaultdict
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from threading import RLock
+from timeit import default_timer as timer
+
+from flask import (
+    Blueprint, current_app, g, has_app_context, has_request_context, request)
+from sqlalchemy.pool import QueuePool
+
+from builtins import *
+
+DEF_BUCKETS = [
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5,
+    7.5, 10]
+
+DEF_INTERVAL = 1
+DEAD_NAME = 'dead'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency'),
+    'http_requests_total': ('counter', 'Requests by status'),
+    'http_requests_in_flight': ('gauge', 'Requests being handled'),
+    'serialization_seconds': ('histogram', 'JSON encoding time'),
+    'db_pool_checkout_wait_seconds': ('histogram', 'Connection wait time')}
+
+
+def format_value(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+def format_labels(labels):
+    escape = lambda v: v.replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+    pairs = ('{}="{}"'.format(k, escape(str(v))) for k, v in labels)
+    return '{{{}}}'.format(','.join(pairs)) if labels else ''
+
+
+def sort_key(row):
+    """Orders rows by labels, then name, then histogram bucket"""
+    name, labels, value = row
+    le = dict(labels).get('le')
+    others = [label for label in labels if label[0] != 'le']
+    return (others, name, float(le) if le else 0)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    else:
+        return True
+
+
+class Registry(object):
+    """The metric values of a process, written to `dirname` (if any) as
+    `<name>.json`
+    """
+    def __init__(self, dirname=None, interval=DEF_INTERVAL, name=None):
+        self.dirname = dirname
+        self.interval = interval
+        self.name = name or str(os.getpid())
+        self.values = defaultdict(float)
+        self.gauges = defaultdict(float)
+        self.tables = {}
+        self.next_flush = 0
+        self.lock = RLock()
+
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            self.values[(name, tuple(labels))] += value
+
+    def add(self, name, labels=(), value=1):
+        with self.lock:
+            self.gauges[(name, tuple(labels))] += value
+
+    def observe(self, name, labels=(), value=0, buckets=DEF_BUCKETS):
+        labels = tuple(labels)
+
+        with self.lock:
+            for bucket in buckets + [float('inf')]:
+                if value <= bucket:
+                    key = labels + (('le', format_value(bucket)),)
+                    self.values[('{}_bucket'.format(name), key)] += 1
+
+            self.values[('{}_sum'.format(name), labels)] += value
+            self.values[('{}_count'.format(name), labels)] += 1
+
+    def dump(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'values': [[n, l, v] for (n, l), v in self.values.items()],
+                'gauges': [[n, l, v] for (n, l), v in self.gauges.items()]}
+
+    def flush(self, force=False):
+        if not self.dirname or not (force or timer() > self.next_flush):
+            return
+
+        self.next_flush = timer() + self.interval
+        kwargs = {'dir': self.dirname, 'delete': False, 'mode': 'w'}
+
+        # write then rename so readers never see a partial file
+        with NamedTemporaryFile(suffix='.tmp', **kwargs) as f:
+            json.dump(self.dump(), f)
+
+        path = os.path.join(self.dirname, '{}.json'.format(self.name))
+        os.rename(f.name, path)
+
+    @contextmanager
+    def locked(self, operation):
+        """Holds a lock on `dirname` shared by all the processes"""
+        with open(os.path.join(self.dirname, '.lock'), 'a') as f:
+            fcntl.flock(f, operation)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        """Returns a dict mapping the paths of `dirname`'s files to their
+        dumps
+        """
+        dumps = {}
+
+        for filename in os.listdir(self.dirname):
+            if filename.endswith('.json'):
+                path = os.path.join(self.dirname, filename)
+
+                with open(path) as f:
+                    dumps[path] = json.load(f)
+
+        return dumps
+
+    def compact(self):
+        """Folds the counters of the processes which have exited into
+        `dead.json` and removes their files
+        """
+        dead_path = os.path.join(self.dirname, '{}.json'.format(DEAD_NAME))
+        values = defaultdict(float)
+
+        with self.locked(fcntl.LOCK_EX):
+            dumps = self.read()
+            dead = [
+                path for path, dumped in dumps.items()
+                if dumped['pid'] and not is_alive(dumped['pid'])]
+
+            if not dead:
+                return
+
+            folded = [dumps[p] for p in dead + [dead_path] if p in dumps]
+
+            for dumped in folded:
+                for name, labels, value in dumped['values']:
+                    values[(name, tuple(map(tuple, labels)))] += value
+
+            kwargs = {'dir': self.dirname, 'delete': False, 'mode': 'w'}
+            rows = [[n, l, v] for (n, l), v in values.items()]
+
+            with NamedTemporaryFile(suffix='.tmp', **kwargs) as f:
+                json.dump({'pid': None, 'values': rows, 'gauges': []}, f)
+
+            os.rename(f.name, dead_path)
+
+            for path in dead:
+                os.remove(path)
+
+    def gen_dumps(self):
+        if not self.dirname:
+            yield self.dump()
+            return
+
+        self.flush(True)
+        self.compact()
+
+        with self.locked(fcntl.LOCK_SH):
+            dumps = self.read()
+
+        for dumped in dumps.values():
+            yield dumped
+
+    def collect(self):
+        """Returns the values of all the processes summed by metric and
+        labels (gauges only include the live processes)
+        """
+        values = defaultdict(float)
+
+        for dumped in self.gen_dumps():
+            rows = dumped['values']
+
+            if dumped['pid'] and is_alive(dumped['pid']):
+                rows += dumped['gauges']
+
+            for name, labels, value in rows:
+                values[(name, tuple(map(tuple, labels)))] += value
+
+        return values
+
+    def render(self):
+        """Returns the collected values in the Prometheus text format"""
+        by_metric = defaultdict(list)
+
+        for (name, labels), value in self.collect().items():
+            for base in METRICS:
+                if name == base or name.startswith('{}_'.format(base)):
+                    by_metric[base].append((name, labels, value))
+
+        lines = []
+
+        for base in sorted(by_metric):
+            kind, help_text = METRICS[base]
+            lines.append('# HELP {} {}'.format(base, help_text))
+            lines.append('# TYPE {} {}'.format(base, kind))
+
+            for name, labels, value in sorted(by_metric[base], key=sort_key):
+                lines.append('{}{} {}'.format(
+                    name, format_labels(labels), format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_registry():
+    return current_app.extensions['metrics']
+
+
+def get_table():
+    tables = get_registry().tables
+    return tables.get(request.blueprint) or request.endpoint or ''
+
+
+def start():
+    g.metrics_start = timer()
+    g.metrics_labels = [('method', request.method), ('table', get_table())]
+    get_registry().add('http_requests_in_flight', g.metrics_labels)
+
+
+def set_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish(exc=None):
+    start = g.pop('metrics_start', None)
+
+    if start is None:
+        return
+
+    registry = get_registry()
+    status = g.pop('metrics_status', 500)
+    labels = g.pop('metrics_labels')
+    duration = timer() - start
+    registry.observe('http_request_duration_seconds', labels, duration)
+    registry.inc('http_requests_total', labels + [('status', status)])
+    registry.add('http_requests_in_flight', labels, -1)
+    registry.flush()
+
+
+def timed_encoder(encoder):
+    """Returns a subclass of the JSON `encoder` recording its encoding
+    times
+    """
+    class TimedEncoder(encoder):
+        def encode(self, obj):
+            start = timer()
+
+            try:
+                return super(TimedEncoder, self).encode(obj)
+            finally:
+                if has_request_context():
+                    labels = [('table', get_table())]
+                    duration = timer() - start
+                    get_registry().observe(
+                        'serialization_seconds', labels, duration)
+
+    return TimedEncoder
+
+
+class TimedQueuePool(QueuePool):
+    """A `QueuePool` which records the time each checkout waits for a
+    connection in the current app's registry. Being the pool's class, it's
+    kept by the pools `engine.dispose()` recreates.
+    """
+    def _do_get(self):
+        start = timer()
+
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            if has_app_context() and 'metrics' in current_app.extensions:
+                duration = timer() - start
+                get_registry().observe(
+                    'db_pool_checkout_wait_seconds', value=duration)
+
+
+def create_blueprint(registry):
+    blueprint = Blueprint('metrics', __name__)
+
+    @blueprint.route('/metrics')
+    def metrics():
+        return current_app.response_class(
+            registry.render(), content_type=CONTENT_TYPE)
+
+    return blueprint
+
+
+def init_app(app, db):
+    dirname = app.config.get('METRICS_DIR')
+    interval = app.config.get('METRICS_FLUSH_INTERVAL', DEF_INTERVAL)
+    registry = Registry(dirname, interval)
+    app.extensions['metrics'] = registry
+
+    if dirname:
+        registry.compact()
+
+    app.before_request(start)
+    app.after_request(set_status)
+    app.teardown_request(finish)
+    app.json_encoder = timed_encoder(app.json_encoder)
+    app.register_blueprint(create_blueprint(registry))
+    return registry
+
+
+def register(app, table):
+    """Labels the metrics of the blueprints serving `table` with its name"""
+    name = table.__tablename__
+    suffixes = ['api0', 'bulk', 'export']
+    tables = app.extensions['metrics'].tables
+    tables.update(('{}{}'.format(name, s), name) for s in suffixes)
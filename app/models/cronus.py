@@ -20,9 +20,9 @@ from builtins import *
 class Person(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     currency_id = db.Column(
@@ -57,9 +57,9 @@ class Person(db.Model, ValidationMixin):
 class Company(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), unique=True, nullable=False)
@@ -84,9 +84,9 @@ class Company(db.Model, ValidationMixin):
 class AccountType(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), unique=True, nullable=False)
@@ -105,9 +105,9 @@ class AccountType(db.Model, ValidationMixin):
 class TrxnType(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), unique=True, nullable=False)
@@ -131,9 +131,9 @@ class Account(db.Model, ValidationMixin):
 
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     type_id = db.Column(
@@ -191,9 +191,9 @@ class Account(db.Model, ValidationMixin):
 class Contribution(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     account_id = db.Column(
@@ -225,9 +225,9 @@ class Holding(db.Model, ValidationMixin):
 
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     account_id = db.Column(
@@ -262,11 +262,16 @@ class Holding(db.Model, ValidationMixin):
 
 
 class Transaction(db.Model, ValidationMixin):
+    # constraints
+    __table_args__ = (
+        db.Index('ix_transaction_holding_id_date', 'holding_id', 'date'),
+        db.Index('ix_transaction_date_id', 'date', 'id'), {})
+
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     type_id = db.Column(
@@ -301,3 +306,51 @@ class Transaction(db.Model, ValidationMixin):
 
     def __str__(self):
         return ('%s: %s' % (self.type, self.holding))
+
+
+class Lot(db.Model, ValidationMixin):
+    # constraints
+    __table_args__ = (
+        db.Index('ix_lot_holding_id_open_date', 'holding_id', 'open_date'), {})
+
+    # auto keys
+    id = db.Column(db.Integer, primary_key=True)
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
+    utc_updated = db.Column(
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
+
+    # foreign keys
+    holding_id = db.Column(
+        db.Integer, db.ForeignKey(
+            'holding.id', onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False)
+
+    holding = db.relationship(
+        'Holding', lazy='joined',
+        backref=backref('lots', cascade='all, delete'))
+
+    open_trxn_id = db.Column(
+        db.Integer, db.ForeignKey(
+            'transaction.id', onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False)
+
+    close_trxn_id = db.Column(
+        db.Integer, db.ForeignKey(
+            'transaction.id', onupdate="CASCADE", ondelete="SET NULL"))
+
+    # other keys
+    shares = db.Column(db.Float, nullable=False)
+    open_date = db.Column(db.DateTime, nullable=False)
+    open_price = db.Column(db.Float, nullable=False)
+    close_date = db.Column(db.DateTime)
+    close_price = db.Column(db.Float)
+
+    # validation
+    val.validates_constraints()
+
+    def __repr__(self):
+        return ('<Lot(%r, %r, %r)>' % (
+            self.holding_id, self.open_trxn_id, self.close_trxn_id))
+
+    def __str__(self):
+        return ('%s: %s' % (self.holding, self.shares))
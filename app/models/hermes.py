@@ -20,9 +20,9 @@ from builtins import *
 class Exchange(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     symbol = db.Column(db.String(12), unique=True, nullable=False)
@@ -38,9 +38,9 @@ class Exchange(db.Model, ValidationMixin):
 class DataSource(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), nullable=False, unique=True)
@@ -55,9 +55,9 @@ class DataSource(db.Model, ValidationMixin):
 class CommodityGroup(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), nullable=False, unique=True)
@@ -72,9 +72,9 @@ class CommodityGroup(db.Model, ValidationMixin):
 class CommodityType(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     group_id = db.Column(
@@ -100,9 +100,9 @@ class CommodityType(db.Model, ValidationMixin):
 class Commodity(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     type_id = db.Column(
@@ -145,9 +145,9 @@ class Commodity(db.Model, ValidationMixin):
 class EventType(db.Model, ValidationMixin):
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # other keys
     name = db.Column(db.String(64), nullable=False, unique=True)
@@ -163,13 +163,17 @@ class Event(db.Model, ValidationMixin):
     # table constraints
     __table_args__ = (
         db.UniqueConstraint(
-            'commodity_id', 'date', 'type_id', 'currency_id'), {})
+            'commodity_id', 'date', 'type_id', 'currency_id'),
+        db.Index(
+            'ix_event_commodity_id_currency_id_date', 'commodity_id',
+            'currency_id', 'date'),
+        db.Index('ix_event_date_id', 'date', 'id'), {})
 
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     commodity_id = db.Column(
@@ -208,15 +212,16 @@ class Event(db.Model, ValidationMixin):
 
 
 class Price(db.Model, ValidationMixin):
-    # constraints
+    # constraints (the unique constraint doubles as the history index)
     __table_args__ = (
-        db.UniqueConstraint('commodity_id', 'currency_id', 'date'), {})
+        db.UniqueConstraint('commodity_id', 'currency_id', 'date'),
+        db.Index('ix_price_date_id', 'date', 'id'), {})
 
     # auto keys
     id = db.Column(db.Integer, primary_key=True)
-    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow())
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
     utc_updated = db.Column(
-        db.DateTime, nullable=False, default=dt.utcnow(), onupdate=dt.utcnow())
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
 
     # foreign keys
     commodity_id = db.Column(
@@ -246,3 +251,45 @@ class Price(db.Model, ValidationMixin):
         return (
             '<Price(%r, %r, %r, %r)>' % (
                 self.close, self.commodity_id, self.currency_id, self.date))
+
+
+class Adjustment(db.Model, ValidationMixin):
+    # constraints
+    __table_args__ = (
+        db.UniqueConstraint('commodity_id', 'currency_id', 'date'), {})
+
+    # auto keys
+    id = db.Column(db.Integer, primary_key=True)
+    utc_created = db.Column(db.DateTime, nullable=False, default=dt.utcnow)
+    utc_updated = db.Column(
+        db.DateTime, nullable=False, default=dt.utcnow, onupdate=dt.utcnow)
+
+    # foreign keys
+    commodity_id = db.Column(
+        db.Integer, db.ForeignKey('commodity.id'), nullable=False)
+
+    commodity = db.relationship(
+        'Commodity', backref=backref('commodity_adjustments',
+        cascade='all, delete'), lazy='joined',
+        primaryjoin='Commodity.id==Adjustment.commodity_id')
+
+    currency_id = db.Column(
+        db.Integer, db.ForeignKey('commodity.id'), nullable=False)
+
+    currency = db.relationship(
+        'Commodity', backref=backref('currency_adjustments',
+        cascade='all, delete'), lazy='joined',
+        primaryjoin='Commodity.id==Adjustment.currency_id')
+
+    # other keys
+    # the product of the factors of all events on or before `date`
+    factor = db.Column(db.Float, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+
+    # validation
+    val.validates_constraints()
+
+    def __repr__(self):
+        return (
+            '<Adjustment(%r, %r, %r, %r)>' % (
+                self.factor, self.commodity_id, self.currency_id, self.date))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+    app.pool
+    ~~~~~~~~
+
+    Provides the database connection pool options and gevent mode
+
+    The pool is sized with the Flask-SQLAlchemy `SQLALCHEMY_POOL_SIZE`,
+    `SQLALCHEMY_MAX_OVERFLOW`, `SQLALCHEMY_POOL_TIMEOUT` and
+    `SQLALCHEMY_POOL_RECYCLE` options. If `SQLALCHEMY_POOL_PRE_PING` is set,
+    each connection is tested as it's checked out and transparently replaced
+    if the database dropped it.
+
+    In gevent mode (`GEVENT`), the psycopg2 connections of gevent workers
+    (i.e., processes whose standard library gevent has patched) wait for the
+    database through the gevent hub instead of blocking the worker, so each
+    worker handles as many concurrent queries as its pool allows. Other
+    processes, e.g., `manage` commands, keep the blocking driver (which also
+    supports COPY). A warning is logged at startup if the app is served by
+    gevent but the database driver isn't cooperative.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from sqlalchemy import event, exc, select
+
+from builtins import *
+
+try:
+    from gevent.monkey import is_module_patched
+    from gevent.socket import wait_read, wait_write
+except ImportError:
+    is_module_patched = wait_read = wait_write = None
+
+try:
+    from psycopg2 import extensions, OperationalError
+except ImportError:
+    extensions = OperationalError = None
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Waits for a psycopg2 connection without blocking other greenlets"""
+    while True:
+        state = conn.poll()
+
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('Bad poll result: {!r}'.format(state))
+
+
+def make_green():
+    """Makes psycopg2 cooperative with gevent. Returns `True` on success."""
+    if extensions and wait_read:
+        extensions.set_wait_callback(gevent_wait_callback)
+        return True
+    else:
+        return False
+
+
+def is_patched():
+    """Returns `True` if gevent has patched the standard library, e.g., in a
+    gunicorn gevent worker
+    """
+    return bool(is_module_patched and is_module_patched('socket'))
+
+
+def is_green(engine):
+    """Returns `True` if `engine`'s driver yields to gevent while waiting"""
+    if engine.dialect.driver == 'psycopg2':
+        return bool(extensions and extensions.get_wait_callback())
+    else:
+        # pure python drivers are patched along with the socket module
+        return engine.dialect.driver in {'pg8000', 'pymysql'} and is_patched()
+
+
+def ping(connection, branch):
+    """Replaces a checked out connection the database has dropped"""
+    if branch:
+        # a sub-connection of an already tested connection
+        return
+
+    save_should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as err:
+        if err.connection_invalidated:
+            # the pool was refreshed, so the retry gets a new connection
+            connection.scalar(select([1]))
+        else:
+            raise
+    finally:
+        connection.should_close_with_result = save_should_close_with_result
+
+
+def init_app(app, db):
+    engine = db.get_engine(app)
+
+    if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+        event.listen(engine, 'engine_connect', ping)
+
+    if not is_patched():
+        return
+
+    if app.config.get('GEVENT') and not make_green():
+        app.logger.warning('GEVENT is set but gevent or psycopg2 is missing')
+
+    if not is_green(engine):
+        msg = 'The %s driver blocks the gevent hub, so queries are serialized'
+        app.logger.warning(msg, engine.dialect.driver)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+    app.replicas
+    ~~~~~~~~~~~~
+
+    Provides read replica routing
+
+    The reads of GET (and HEAD/OPTIONS) requests, i.e., the Flask-Restless
+    GET endpoints, swagger, exports, and the analytics routes, go to a random
+    healthy replica of `SQLALCHEMY_REPLICA_URIS`. Everything else (writes,
+    flushes, and work outside of a request) goes to the primary.
+
+    A client which just wrote gets a `read_primary` cookie, so its reads stay
+    on the primary for `REPLICA_STICKY_SECONDS` (read-your-writes).
+
+    Every `REPLICA_CHECK_INTERVAL` seconds, a background thread (started by
+    each worker's first request) takes replicas lagging more than
+    `REPLICA_MAX_LAG` seconds (or failing) out of rotation. Until its first
+    check, reads go to the primary. The lag is reported by PostgreSQL
+    replicas and otherwise estimated from the newest `utc_updated` of the
+    `REPLICA_LAG_TABLE` table (e.g., for two SQLite files).
+
+    Reads which fill a cache (a response cache miss, a price series, or the
+    fx rates) go to the primary via `use_primary`, so a lagging replica's
+    data is never cached as current.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import random
+import time
+
+from contextlib import contextmanager
+from threading import Lock, Thread
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import (
+    SQLAlchemy as _SQLAlchemy, SignallingSession, get_state)
+from sqlalchemy import MetaData, Table, func, orm, select
+from sqlalchemy.pool import QueuePool
+
+from app.metrics import TimedQueuePool
+from builtins import *
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+STICKY_COOKIE = 'read_primary'
+DEF_MAX_LAG = 30
+DEF_INTERVAL = 10
+DEF_STICKY_SECONDS = 5
+DEF_LAG_TABLE = 'price'
+
+PG_LAG = """
+    SELECT CASE WHEN {0}receive_{1}() = {0}replay_{1}() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"""
+
+
+class RoutingSession(SignallingSession):
+    """A session which reads from the replica chosen for the request"""
+    def get_bind(self, mapper=None, clause=None):
+        key = g.get('replica') if has_request_context() else None
+
+        if key and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=key)
+        else:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        default = info.get_dialect().get_pool_class(info)
+
+        # time the checkouts of the engines which would use a `QueuePool`
+        if 'poolclass' not in options and issubclass(default, QueuePool):
+            options['poolclass'] = TimedQueuePool
+
+
+@contextmanager
+def use_primary():
+    """Routes the reads within the block to the primary"""
+    replica = g.get('replica') if has_request_context() else None
+
+    if replica:
+        g.replica = None
+
+    try:
+        yield
+    finally:
+        if replica:
+            g.replica = replica
+
+
+def get_lag(primary, replica, table_name=DEF_LAG_TABLE):
+    """Returns the number of seconds `replica` is behind `primary`"""
+    if replica.dialect.name == 'postgresql':
+        with replica.connect() as conn:
+            # the server version is only known once connected
+            if conn.dialect.server_version_info >= (10,):
+                names = ('pg_last_wal_', 'lsn')
+            else:
+                names = ('pg_last_xlog_', 'location')
+
+            return float(conn.scalar(PG_LAG.format(*names)) or 0)
+
+    table = Table(table_name, MetaData(), autoload=True, autoload_with=primary)
+    query = select([func.max(table.c.utc_updated)])
+    latest, replicated = primary.scalar(query), replica.scalar(query)
+
+    if latest is None:
+        return 0
+    elif replicated is None:
+        return float('inf')
+    else:
+        return max((latest - replicated).total_seconds(), 0)
+
+
+class Router(object):
+    """Picks the replica of each request from those which are healthy"""
+    def __init__(self, app, db, keys):
+        self.app = app
+        self.db = db
+        self.keys = keys
+        self.healthy = []
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', DEF_MAX_LAG)
+        self.interval = app.config.get('REPLICA_CHECK_INTERVAL', DEF_INTERVAL)
+        self.lag_table = app.config.get('REPLICA_LAG_TABLE', DEF_LAG_TABLE)
+        self.thread = None
+        self.lock = Lock()
+
+    def check(self):
+        """Takes lagging (or unreachable) replicas out of rotation"""
+        primary, healthy = self.db.get_engine(self.app), []
+
+        for key in self.keys:
+            replica = self.db.get_engine(self.app, bind=key)
+
+            try:
+                lag = get_lag(primary, replica, self.lag_table)
+            except Exception as e:
+                self.app.logger.warning('Replica %s failed: %s', key, e)
+                continue
+
+            if lag <= self.max_lag:
+                healthy.append(key)
+            else:
+                msg = 'Replica %s is %.1fs behind'
+                self.app.logger.warning(msg, key, lag)
+
+        self.healthy = healthy
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    self.app.logger.warning('Replica check failed: %s', e)
+
+                time.sleep(self.interval)
+
+    def start(self):
+        """Starts the checks (in this process, i.e., after any fork)"""
+        with self.lock:
+            if not (self.thread and self.thread.is_alive()):
+                self.thread = Thread(target=self.run, name='replica-check')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def choose(self):
+        if not self.thread:
+            self.start()
+
+        return random.choice(self.healthy) if self.healthy else None
+
+    def before_request(self):
+        safe = request.method in SAFE_METHODS
+        g.replica = None
+
+        if safe and not request.cookies.get(STICKY_COOKIE):
+            g.replica = self.choose()
+
+    def after_request(self, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            seconds = self.app.config.get(
+                'REPLICA_STICKY_SECONDS', DEF_STICKY_SECONDS)
+
+            response.set_cookie(STICKY_COOKIE, '1', max_age=seconds)
+
+        return response
+
+
+def init_app(app, db):
+    """Adds a bind per replica and routes the requests' reads to them"""
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS')
+
+    if not uris:
+        return
+
+    replicas = dict(('replica{}'.format(pos), u) for pos, u in enumerate(uris))
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    app.config['SQLALCHEMY_BINDS'] = dict(binds, **replicas)
+    router = Router(app, db, sorted(replicas))
+    app.extensions['replicas'] = router
+    app.before_request(router.before_request)
+    app.after_request(router.after_request)
+    return router
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+    app.series
+    ~~~~~~~~~~
+
+    Provides a process-local, array-backed cache of price series
+
+    The valuations (`app.valuation`) and the price history and returns
+    (`app.history`) are computed from the cached series rather than from
+    `Price` rows.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime as dt
+from threading import RLock
+from timeit import default_timer as timer
+
+from flask import current_app
+
+from app import signals
+from app.history import query_history
+from app.replicas import use_primary
+from builtins import *
+
+DEF_MAX_BYTES = 64 * 1024 * 1024
+DEF_TTL = 300
+
+to_ordinal = lambda date: date.toordinal()
+from_ordinal = lambda ordinal: dt.fromordinal(ordinal)
+
+
+def to_returns(closes):
+    """Returns the simple period returns of the sequence of `closes`"""
+    pairs = zip(closes[1:], closes[:-1])
+    return array(str('d'), (cur / prev - 1 for cur, prev in pairs))
+
+
+class PriceSeries(object):
+    """The daily closes of a single (commodity_id, currency_id) pair.
+
+    Dates are stored as proleptic Gregorian ordinals in an `array('l')` and
+    closes as an `array('d')`, so any time of day component is dropped.
+    """
+    __slots__ = ('dates', 'closes')
+
+    def __init__(self, rows=None):
+        self.dates = array(str('l'))
+        self.closes = array(str('d'))
+        self.extend(rows or [])
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        dates, closes = self.dates, self.closes
+        return dates.itemsize * len(dates) + closes.itemsize * len(closes)
+
+    @property
+    def last_date(self):
+        return from_ordinal(self.dates[-1]) if self.dates else None
+
+    @property
+    def latest(self):
+        return self.closes[-1] if self.closes else None
+
+    def extend(self, rows):
+        """Appends (date, close) `rows` which must be sorted by date"""
+        for date, close in rows:
+            self.dates.append(to_ordinal(date))
+            self.closes.append(close)
+
+    def get_slice(self, start=None, end=None):
+        """Returns the (dates, closes) arrays between `start` and `end`"""
+        dates = self.dates
+        lo = bisect_left(dates, to_ordinal(start)) if start else 0
+        hi = bisect_right(dates, to_ordinal(end)) if end else len(dates)
+        return dates[lo:hi], self.closes[lo:hi]
+
+    def asof(self, date):
+        """Returns the last close on or before `date`"""
+        pos = bisect_right(self.dates, to_ordinal(date))
+        return self.closes[pos - 1] if pos else None
+
+    def returns(self, start=None, end=None):
+        """Returns the simple period returns between `start` and `end`"""
+        return to_returns(self.get_slice(start, end)[1])
+
+
+class SeriesCache(object):
+    """An LRU cache of `PriceSeries` bounded by `max_bytes`.
+
+    Series are loaded lazily on first access. Committed `Price` changes mark
+    the affected series as stale; a stale series is extended with just the
+    new rows if every change is after its last date and reloaded otherwise.
+    Since other processes' writes aren't signalled, a series is also
+    reloaded once it's `ttl` seconds old.
+    """
+    def __init__(self, db, max_bytes=DEF_MAX_BYTES, ttl=DEF_TTL):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.series = OrderedDict()
+        self.stale = {}
+        self.expires = {}
+        self.lock = RLock()
+
+    def __contains__(self, key):
+        return key in self.series
+
+    def load(self, key, start=None):
+        from app.models.hermes import Price
+
+        columns = [Price.close]
+        return query_history(self.db.session, Price, columns, *key, start=start)
+
+    def evict(self):
+        while self.nbytes > self.max_bytes and len(self.series) > 1:
+            key, series = self.series.popitem(last=False)
+            self.nbytes -= series.nbytes
+            self.stale.pop(key, None)
+            self.expires.pop(key, None)
+
+    def get(self, commodity_id, currency_id):
+        key = (commodity_id, currency_id)
+
+        with self.lock, use_primary():
+            series = self.series.pop(key, None)
+            changed = self.stale.pop(key, None)
+
+            if series is not None:
+                self.nbytes -= series.nbytes
+
+            if series is not None and timer() > self.expires[key]:
+                series = None
+
+            if series is None:
+                series = PriceSeries(self.load(key))
+                self.expires[key] = timer() + self.ttl
+            elif changed is not None:
+                if series.dates and changed > series.dates[-1]:
+                    start = from_ordinal(series.dates[-1] + 1)
+                    series.extend(self.load(key, start))
+                else:
+                    series = PriceSeries(self.load(key))
+
+            self.series[key] = series
+            self.nbytes += series.nbytes
+            self.evict()
+
+        return series
+
+    def invalidate(self, changes):
+        """Marks the cached series of the changed `price` rows as stale"""
+        with self.lock:
+            for row in changes.get('price', []):
+                key = (row.get('commodity_id'), row.get('currency_id'))
+                date = row.get('date')
+
+                if key in self.series:
+                    changed = to_ordinal(date) if date else 0
+                    self.stale[key] = min(self.stale.get(key, changed), changed)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+            self.stale.clear()
+            self.expires.clear()
+            self.nbytes = 0
+
+
+def init_app(app, db):
+    max_bytes = app.config.get('SERIES_CACHE_MAX_BYTES', DEF_MAX_BYTES)
+    ttl = app.config.get('SERIES_CACHE_TTL', DEF_TTL)
+    cache = SeriesCache(db, max_bytes, ttl)
+    app.extensions['series'] = cache
+    signals.connect(app, cache.invalidate)
+    return cache
+
+
+def get_series(commodity_id, currency_id):
+    return current_app.extensions['series'].get(commodity_id, currency_id)
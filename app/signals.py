@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    app.signals
+    ~~~~~~~~~~~
+
+    Provides notifications of committed table changes
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.base import NO_VALUE
+
+from builtins import *
+
+
+def get_changes(session):
+    return session.info.setdefault('changes', defaultdict(list))
+
+
+def record(session, table, rows):
+    """Records column value dicts written to `table` outside of the ORM (e.g.,
+    by a core `insert`) so that they are included in the next commit's changes
+    """
+    get_changes(session)[table.__tablename__].extend(rows)
+
+
+def connect(app, receiver):
+    """Registers `receiver` to be called with a dict mapping table names to
+    lists of changed rows (column value dicts) whenever a session commits
+    within `app`.
+    """
+    app.extensions.setdefault('signals', []).append(receiver)
+
+
+def gen_rows(instance):
+    """Yields the current column values of `instance` and, if any column was
+    modified, its previously committed values as well.
+    """
+    state = inspect(instance)
+    keys = [attr.key for attr in state.mapper.column_attrs]
+    values = state.dict
+    yield dict((k, values.get(k)) for k in keys)
+
+    committed = dict(
+        (k, v) for k, v in state.committed_state.items()
+        if k in keys and v is not NO_VALUE)
+
+    if committed:
+        yield dict((k, committed.get(k, values.get(k))) for k in keys)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def after_flush(session, flush_context):
+    changes = get_changes(session)
+
+    for instance in session.new | session.dirty | session.deleted:
+        table = getattr(instance, '__tablename__', None)
+
+        if table:
+            changes[table].extend(gen_rows(instance))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def after_commit(session):
+    changes = session.info.pop('changes', None)
+
+    if changes and has_app_context():
+        for receiver in current_app.extensions.get('signals', []):
+            receiver(changes)
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def after_soft_rollback(session, previous_transaction):
+    session.info.pop('changes', None)
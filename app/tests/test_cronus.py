@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+    app.tests.test_cronus
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Provides unit tests for the :mod:`app.cronus` module.
+"""
+
+from json import loads, dumps
+
+import pytest
+
+from app import create_app, db
+from app.bulk import load
+from app.models.cronus import Transaction
+from app.helper import (
+    get_table_names, get_models, get_init_data, gen_tables, populate, JSON,
+    get_json)
+
+
+@pytest.fixture
+def client(request):
+    app = create_app(config_mode='Test')
+    client = app.test_client()
+    models = get_models()
+    tables = list(gen_tables(models))
+    client.prefix = app.config.get('API_URL_PREFIX', '')
+
+    def post(table, rows):
+        url = '{}{}/bulk'.format(client.prefix, table)
+        return client.post(url, data=dumps(rows), content_type=JSON)
+
+    client.post_bulk = post
+
+    with app.app_context():
+        db.create_all()
+        client.tables = get_table_names(tables)
+        list(populate(db.session, get_init_data()))
+
+    return client
+
+
+def test_get_account_holdings(client):
+    """Test for getting an account's holdings relation using
+    :http:method:`get`.
+    """
+    r = client.get('{}account/1/holdings'.format(client.prefix))
+    assert r.status_code == 200
+    json = get_json(r)
+    assert json['num_results'] == 3
+    assert [o['commodity_id'] for o in json['objects']] == [6, 7, 8]
+
+
+def test_get_person_valuation(client):
+    """Test for valuing a person's holdings using :http:method:`get`."""
+    trxns = [
+        {'holding_id': 1, 'type_id': 1, 'shares': 10, 'price': 90},
+        {'holding_id': 1, 'type_id': 2, 'shares': 4, 'price': 95},
+        {'holding_id': 2, 'type_id': 1, 'shares': 5, 'price': 150}]
+
+    for d in trxns:
+        url = client.prefix + 'transaction'
+        client.post(url, data=dumps(d), content_type=JSON)
+
+    prices = [
+        {'commodity_id': 6, 'currency_id': 1, 'close': 99, 'date': '1/1/17'},
+        {'commodity_id': 6, 'currency_id': 1, 'close': 100, 'date': '1/2/17'},
+        {'commodity_id': 7, 'currency_id': 1, 'close': 160, 'date': '1/1/17'}]
+
+    client.post_bulk('price', prices)
+
+    r = client.get('{}person/1/valuation'.format(client.prefix))
+    assert r.status_code == 200
+
+    json = get_json(r)
+    objects = json['objects']
+    values = [(h['holding_id'], h['shares'], h['value']) for h in objects]
+    assert values == [(1, 6, 600), (2, 5, 800), (3, 0, None)]
+    assert json['totals'] == [{'currency_id': 1, 'value': 1400}]
+
+    r = client.get('{}person/9/valuation'.format(client.prefix))
+    assert r.status_code == 404
+
+
+def test_lots(client):
+    """Test that posting, patching and deleting transactions updates the
+    holding's lots.
+    """
+    url = client.prefix + 'transaction'
+    trxns = [
+        {'type_id': 1, 'shares': 10, 'price': 10, 'date': '1/1/17'},
+        {'type_id': 1, 'shares': 10, 'price': 20, 'date': '2/1/17'},
+        {'type_id': 2, 'shares': 15, 'price': 30, 'date': '3/1/17'}]
+
+    for d in trxns:
+        d['holding_id'] = 1
+        r = client.post(url, data=dumps(d), content_type=JSON)
+        assert r.status_code == 201
+
+    def get_basis():
+        r = client.get('{}account/1/valuation'.format(client.prefix))
+        holding = get_json(r)['objects'][0]
+        return holding['cost_basis'], holding['realized_gain']
+
+    # FIFO sells all 10 @ 10 and 5 of the 10 @ 20
+    assert get_basis() == (100, 250)
+
+    # patch the first buy and test that the lots were replayed
+    d = {'price': 12}
+    client.patch(url + '/1', data=dumps(d), content_type=JSON)
+    assert get_basis() == (100, 230)
+
+    # post an earlier sell and test that the lots were replayed
+    d = {
+        'holding_id': 1, 'type_id': 2, 'shares': 5, 'price': 15,
+        'date': '1/15/17'}
+
+    client.post(url, data=dumps(d), content_type=JSON)
+    assert get_basis() == (0, 15 + 90 + 100)
+
+    # delete the last sell and test that its lots were reopened
+    client.delete(url + '/3')
+    assert get_basis() == (60 + 200, 15)
+
+    # bulk load a sell and test that its lots were matched
+    d = {
+        'holding_id': 1, 'type_id': 2, 'shares': 10, 'price': 25,
+        'date': '4/1/17'}
+
+    with client.application.app_context():
+        assert load(db.session, Transaction, [d]) == (1, [])
+        db.session.commit()
+
+    assert get_basis() == (100, 15 + 65 + 25)
+
+
+def test_get_converted_valuation(client):
+    """Test for valuing a person's holdings in another currency using
+    :http:method:`get`.
+    """
+    d = {'holding_id': 1, 'type_id': 1, 'shares': 10, 'price': 90}
+    client.post(client.prefix + 'transaction', data=dumps(d),
+                content_type=JSON)
+
+    # EUR/USD, GBP/EUR and a stale EUR/USD quote
+    prices = [
+        {'commodity_id': 6, 'currency_id': 1, 'close': 132, 'date': '1/2/17'},
+        {'commodity_id': 2, 'currency_id': 1, 'close': 1.1, 'date': '1/1/17'},
+        {'commodity_id': 2, 'currency_id': 1, 'close': 1.2, 'date': '1/2/17'},
+        {'commodity_id': 3, 'currency_id': 2, 'close': 1.1, 'date': '1/2/17'}]
+
+    client.post_bulk('price', prices)
+
+    # USD -> EUR -> GBP
+    url = '{}person/1/valuation?currency=GBP'.format(client.prefix)
+    json = get_json(client.get(url))
+    assert json['target_currency_id'] == 3
+    assert json['target_total'] == pytest.approx(1000)
+    assert json['objects'][0]['target_value'] == pytest.approx(1000)
+
+    # add a direct GBP/USD quote and test that the graph was rebuilt
+    d = {'commodity_id': 3, 'currency_id': 1, 'close': 1.25, 'date': '1/3/17'}
+    client.post_bulk('price', [d])
+    json = get_json(client.get(url))
+    assert json['target_total'] == pytest.approx(1056)
+
+    r = client.get('{}person/1/valuation?currency=XYZ'.format(client.prefix))
+    assert r.status_code == 404
+
+    r = client.get('{}person/1/valuation?currency_id=abc'.format(
+        client.prefix))
+
+    assert r.status_code == 400
+
+    # test that holdings without a rate to CAD don't give a partial total
+    url = '{}person/1/valuation?currency=CAD'.format(client.prefix)
+    json = get_json(client.get(url))
+    assert json['target_total'] is None
+    assert json['num_unconverted'] == 1
@@ -7,10 +7,16 @@
 """
 
 from json import loads, dumps
+from datetime import datetime
 
 import pytest
 
+from sqlalchemy import event
+
 from app import create_app, db
+from app.bulk import find_existing, gen_stored, validate_rows
+from app.models.hermes import Commodity, Price
+from app.series import get_series
 from app.helper import (
     get_table_names, get_models, process, get_init_data, gen_tables,
     JSON, get_json)
@@ -120,3 +126,394 @@ def test_post_price(client):
 
     # test that the new price was added
     assert client.get_num_results(table) == num + 1
+
+
+def test_bulk_post_price(client):
+    """Test for posting a batch of prices using :http:method:`post`."""
+    table = 'price'
+    d = {'commodity_id': 6, 'currency_id': 1, 'close': 30, 'date': '1/2/17'}
+    client.post(client.prefix + table, data=dumps(d), content_type=JSON)
+    num = client.get_num_results(table)
+
+    # add prices, one which already exists and one which is duplicated
+    rows = [
+        d, dict(d, date='1/3/17'), dict(d, date='1/4/17'),
+        dict(d, date='1/4/17', close=31), {'commodity_id': 6, 'close': 30}]
+
+    url = '{}{}/bulk'.format(client.prefix, table)
+    r = client.post(url, data=dumps(rows), content_type=JSON)
+    assert r.status_code == 201
+
+    # test that only the valid prices were added
+    json = get_json(r)
+    assert json['num_results'] == 2
+    assert [e['index'] for e in json['errors']] == [0, 3, 4]
+    assert json['errors'][2]['validation_errors'] == {
+        'currency_id': 'Please enter a value'}
+
+    assert client.get_num_results(table) == num + 2
+
+
+def test_bulk_post_event_ndjson(client):
+    """Test for posting newline delimited events using :http:method:`post`."""
+    table = 'event'
+    num = client.get_num_results(table)
+    d = {'commodity_id': 6, 'currency_id': 1, 'type_id': 1, 'value': 0.5}
+    rows = [dict(d, date='{}/1/16'.format(m)) for m in range(1, 13)]
+    data = '\n'.join(map(dumps, rows))
+
+    url = '{}{}/bulk'.format(client.prefix, table)
+    r = client.post(url, data=data, content_type='application/x-ndjson')
+    assert r.status_code == 201
+    assert get_json(r)['num_results'] == 12
+    assert client.get_num_results(table) == num + 12
+
+
+def test_bulk_validation(client):
+    """Test that bulk rows are validated in sets."""
+    d = {'commodity_id': 6, 'currency_id': 1, 'close': 30, 'date': '1/2/17'}
+    rows = [
+        d, dict(d, date='1/3/17', commodity_id=999),
+        dict(d, date='1/4/17', currency_id='USD'),
+        dict(d, date='1/5/17', commodity_id='6'),
+        dict(d, date='1/6/17', close='abc'),
+        dict(d, date='1/7/17', close='nan'),
+        dict(d, date='1/8/17', currency_id=True),
+        dict(d, date='CURRENT_DATE')]
+
+    url = '{}price/bulk'.format(client.prefix)
+    r = client.post(url, data=dumps(rows), content_type=JSON)
+    json = get_json(r)
+    assert json['num_results'] == 2
+    assert [e['validation_errors'] for e in json['errors']] == [
+        {'commodity_id': 'Value does not exist'},
+        {'currency_id': 'Please enter an integer value'},
+        {'close': 'Please enter a number'}, {'close': 'Please enter a number'},
+        {'currency_id': 'Please enter an integer value'},
+        {'date': 'Please enter a date'}]
+
+    with client.application.app_context():
+        commodity = {
+            'symbol': 'X' * 13, 'name': 'Long', 'type_id': 1,
+            'data_source_id': 1, 'exchange_id': 1}
+
+        invalid = [
+            dict(commodity, symbol=123),
+            dict(commodity, symbol='X', name=['a'])]
+        errors = validate_rows(db.session, Commodity, [commodity] + invalid)
+
+    assert errors == {
+        0: {'symbol': 'Enter a value less than 12 characters long'},
+        1: {'symbol': 'The input must be a string (not a int: 123)'},
+        2: {'name': "The input must be a string (not a list: ['a'])"}}
+
+
+def test_bulk_find_existing(client):
+    """Test that existing rows are looked up by key range per pair."""
+    d = {'commodity_id': 6, 'currency_id': 1, 'close': 30}
+    rows = [dict(d, date='1/{}/17'.format(day)) for day in range(1, 6)]
+    rows += [dict(d, date='1/3/17', currency_id=2)]
+    url = '{}price/bulk'.format(client.prefix)
+    client.post(url, data=dumps(rows), content_type=JSON)
+
+    names = ['commodity_id', 'currency_id', 'date']
+    keys = [(6, 1, datetime(2017, 1, 1)), (6, 2, datetime(2017, 1, 5))]
+    rows = [dict(zip(names, key)) for key in keys]
+
+    with client.application.app_context():
+        stored = list(gen_stored(db.session, Price, rows, names))
+        existing = find_existing(db.session, Price, rows, names)
+
+    # the stored rows of other pairs or dates aren't read
+    assert [tuple(row[:2]) for row in stored] == [(6, 1)]
+    assert [(c, cur) for c, cur, date in existing] == [(6, 1)]
+
+
+def test_bulk_put_price(client, monkeypatch):
+    """Test for upserting a batch of prices using :http:method:`put`."""
+    table = 'price'
+    d = {'commodity_id': 6, 'currency_id': 1, 'close': 30, 'date': '1/2/17'}
+    url = '{}{}/bulk'.format(client.prefix, table)
+    rows = [d, dict(d, date='1/3/17'), dict(d, date='1/4/17')]
+    r = client.put(url, data=dumps(rows), content_type=JSON)
+    assert r.status_code == 200
+    assert get_json(r)['num_results'] == 3
+    before = get_json(client.get(client.prefix + table))['objects']
+
+    # test that unchanged rows are skipped and changed rows are updated
+    rows = [d, dict(d, date='1/3/17', close=31), dict(d, date='1/3/17')]
+    r = client.put(url, data=dumps(rows), content_type=JSON)
+    json = get_json(r)
+    assert json['num_results'] == 1
+    assert [e['index'] for e in json['errors']] == [2]
+
+    after = get_json(client.get(client.prefix + table))['objects']
+    assert [p['id'] for p in after] == [p['id'] for p in before]
+    assert [p['close'] for p in after] == [30, 31, 30]
+    assert after[0]['utc_updated'] == before[0]['utc_updated']
+    assert after[1]['utc_updated'] > before[1]['utc_updated']
+
+    # test that databases without upserts get an error (rather than a 500)
+    with client.application.app_context():
+        dbapi = db.engine.dialect.dbapi
+
+    monkeypatch.setattr(dbapi, 'sqlite_version_info', (3, 23, 1))
+    r = client.put(url, data=dumps(rows), content_type=JSON)
+    assert r.status_code == 501
+    assert get_json(r)['message'] == 'Upserts are not supported'
+
+
+def test_get_price_history(client):
+    """Test for getting a commodity's price history using
+    :http:method:`get`.
+    """
+    d = {'commodity_id': 6, 'currency_id': 1}
+    rows = [dict(d, close=c, date='1/{}/17'.format(c)) for c in range(1, 6)]
+    url = '{}price/bulk'.format(client.prefix)
+    client.post(url, data=dumps(rows), content_type=JSON)
+
+    args = 'symbol=AAPL&currency=USD&start=1/2/17&end=1/4/17'
+    r = client.get('{}price/history?{}'.format(client.prefix, args))
+    assert r.status_code == 200
+
+    json = get_json(r)
+    assert json['closes'] == [2, 3, 4]
+    assert json['dates'][0] == '2017-01-02T00:00:00'
+
+    r = client.get('{}price/history?{}&returns=true'.format(
+        client.prefix, args))
+
+    assert get_json(r)['returns'] == pytest.approx([0.5, 1 / 3])
+
+    # test that unknown symbols aren't found
+    r = client.get('{}price/history?symbol=XYZ&currency=USD'.format(
+        client.prefix))
+
+    assert r.status_code == 404
+
+
+def test_price_series_cache(client):
+    """Test that the price series cache is refreshed by new prices."""
+    d = {'commodity_id': 7, 'currency_id': 1}
+    rows = [dict(d, close=c, date='2/{}/17'.format(c)) for c in range(1, 4)]
+    url = '{}price/bulk'.format(client.prefix)
+    client.post(url, data=dumps(rows), content_type=JSON)
+
+    with client.application.app_context():
+        series = get_series(7, 1)
+        assert list(series.closes) == [1, 2, 3]
+        assert series.asof(datetime(2017, 2, 2, 12)) == 2
+
+        # add a later price and test that the series was extended
+        client.post(url, data=dumps([dict(d, close=5, date='3/1/17')]),
+                    content_type=JSON)
+
+        assert list(get_series(7, 1).closes) == [1, 2, 3, 5]
+
+        # add an earlier price and test that the series was reloaded
+        d.update(close=0.5, date='1/1/17')
+        client.post(client.prefix + 'price', data=dumps(d), content_type=JSON)
+        assert list(get_series(7, 1).closes) == [0.5, 1, 2, 3, 5]
+
+        # test that unsignalled writes are seen once the series expires
+        db.engine.execute('DELETE FROM price WHERE commodity_id = 7')
+        cache = client.application.extensions['series']
+        assert len(get_series(7, 1)) == 5
+
+        cache.expires[(7, 1)] = 0
+        assert not len(get_series(7, 1))
+
+
+def test_get_adjusted_price_history(client):
+    """Test for getting a commodity's split and dividend adjusted price
+    history using :http:method:`get`.
+    """
+    d = {'commodity_id': 8, 'currency_id': 1}
+    closes = [100, 100, 50, 50, 49]
+    rows = [
+        dict(d, close=c, date='1/{}/17'.format(i))
+        for i, c in enumerate(closes, 1)]
+
+    client.post(client.prefix + 'price/bulk', data=dumps(rows),
+                content_type=JSON)
+
+    # add a 2:1 split and a $1 dividend
+    url = client.prefix + 'event'
+    split = dict(d, type_id=3, value=2, date='1/3/17')
+    r = client.post(url, data=dumps(split), content_type=JSON)
+    split_id = get_json(r)['id']
+    dividend = dict(d, type_id=1, value=1, date='1/5/17')
+    client.post(url, data=dumps(dividend), content_type=JSON)
+
+    args = 'symbol=WMT&currency=USD&adjusted=true'
+    r = client.get('{}price/history?{}'.format(client.prefix, args))
+    assert get_json(r)['closes'] == pytest.approx([49] * 5)
+
+    r = client.get('{}price/history?{}&start=1/4/17'.format(
+        client.prefix, args))
+
+    assert get_json(r)['closes'] == pytest.approx([49] * 2)
+
+    # delete the split and test that the adjustments were rebuilt
+    client.delete('{}/{}'.format(url, split_id))
+    r = client.get('{}price/history?{}'.format(client.prefix, args))
+    expected = [98, 98, 49, 49, 49]
+    assert get_json(r)['closes'] == pytest.approx(expected)
+
+    # test that a changed previous close is reflected in the dividend
+    rows = [dict(d, close=25, date='1/4/17')]
+    client.put(client.prefix + 'price/bulk', data=dumps(rows),
+               content_type=JSON)
+
+    r = client.get('{}price/history?{}'.format(client.prefix, args))
+    expected = [96, 96, 48, 24, 49]
+    assert get_json(r)['closes'] == pytest.approx(expected)
+
+    # test that prices after the last event don't rebuild the adjustments
+    statements = []
+    log = lambda conn, cursor, stmt, *args: statements.append(stmt)
+    rows = [dict(d, close=50, date='1/6/17')]
+
+    with client.application.app_context():
+        event.listen(db.engine, 'before_cursor_execute', log)
+        client.post(client.prefix + 'price/bulk', data=dumps(rows),
+                    content_type=JSON)
+
+        event.remove(db.engine, 'before_cursor_execute', log)
+
+    assert statements
+    assert not [s for s in statements if 'adjustment' in s]
+
+
+def test_get_price_profile(client):
+    """Test for getting prices with an include list and sparse fieldsets
+    using :http:method:`get`.
+    """
+    d = {'commodity_id': 6, 'currency_id': 1}
+    rows = [dict(d, close=c, date='1/{}/17'.format(c)) for c in range(1, 4)]
+    client.post(client.prefix + 'price/bulk', data=dumps(rows),
+                content_type=JSON)
+
+    statements = []
+    log = lambda conn, cursor, stmt, *args: statements.append(stmt)
+
+    with client.application.app_context():
+        event.listen(db.engine, 'before_cursor_execute', log)
+
+    url = '{}price?fields[price]=close,date'.format(client.prefix)
+    r = client.get(url)
+    assert r.status_code == 200
+    assert set(get_json(r)['objects'][0]) == {'close', 'date'}
+    assert not any('commodity_type' in stmt for stmt in statements)
+
+    args = 'include=commodity&fields[commodity]=symbol'
+    r = client.get('{}price?{}'.format(client.prefix, args))
+    obj = get_json(r)['objects'][0]
+    assert obj['commodity'] == {'symbol': 'AAPL'}
+    assert obj['close'] == 1 and 'currency' not in obj
+    assert not any('commodity_type' in stmt for stmt in statements)
+
+    r = client.get('{}price?include=foo'.format(client.prefix))
+    assert r.status_code == 400
+
+
+def test_get_price_cursor(client):
+    """Test for paging through prices by cursor using :http:method:`get`."""
+    d = {'commodity_id': 6, 'currency_id': 1}
+    rows = [dict(d, close=c, date='1/{}/17'.format(c)) for c in range(1, 6)]
+    rows.append({
+        'commodity_id': 7, 'currency_id': 1, 'close': 10, 'date': '1/2/17'})
+
+    client.post(client.prefix + 'price/bulk', data=dumps(rows),
+                content_type=JSON)
+
+    url = '{}price?results_per_page=4&cursor='.format(client.prefix)
+    r = client.get(url)
+    assert r.status_code == 200
+
+    json = get_json(r)
+    assert [o['close'] for o in json['objects']] == [1, 2, 10, 3]
+    assert 'page' not in json and 'num_results' not in json
+    assert 'rel="next"' in r.headers['Link']
+
+    r = client.get(url + json['next'])
+    json = get_json(r)
+    assert [o['close'] for o in json['objects']] == [4, 5]
+    assert json['next'] is None
+
+    r = client.get(url + 'foo')
+    assert r.status_code == 400
+
+
+def test_get_price_count_modes(client):
+    """Test for counting prices in each count mode using
+    :http:method:`get`.
+    """
+    d = {'commodity_id': 6, 'currency_id': 1}
+    rows = [dict(d, close=c, date='1/{}/17'.format(c)) for c in range(1, 4)]
+    url = client.prefix + 'price'
+    client.post(url + '/bulk', data=dumps(rows[:2]), content_type=JSON)
+
+    json = get_json(client.get(url))
+    assert json['count_mode'] == 'cached'
+    assert json['num_results'] == 2
+
+    # test that writes invalidate the cached count
+    client.post(url, data=dumps(rows[2]), content_type=JSON)
+    assert get_json(client.get(url))['num_results'] == 3
+
+    # test that the cache is bounded and drops expired counts
+    counts = client.application.extensions['counts']
+    counts.max_entries = 2
+
+    for close in range(1, 4):
+        client.get(url + '?q={"filters":[{"name":"close","op":"gt","val":%s}]}'
+                   % close)
+
+    assert len(counts) == 2
+
+    for key, (num, expires) in list(counts.counts.items()):
+        counts.counts[key] = (num, 0)
+
+    client.get(url)
+    assert len(counts) == 1
+
+    config = client.application.config
+    config['API_COUNT_MODES'] = {'price': 'estimated'}
+    json = get_json(client.get(url))
+    assert json['count_mode'] == 'exact'
+    assert json['num_results'] == 3
+
+    config['API_COUNT_MODES'] = {'price': 'none'}
+    r = client.get(url + '?results_per_page=2')
+    json = get_json(r)
+    assert json['count_mode'] == 'none'
+    assert json['num_results'] is None and json['total_pages'] is None
+    assert 'page=2' in r.headers['Link']
+    assert len(json['objects']) == 2
+
+
+def test_export_price(client):
+    """Test for exporting prices using :http:method:`get`."""
+    d = {'commodity_id': 6, 'currency_id': 1}
+    rows = [dict(d, close=c, date='1/{}/17'.format(c)) for c in range(1, 4)]
+    client.post(client.prefix + 'price/bulk', data=dumps(rows),
+                content_type=JSON)
+
+    url = '{}price/export'.format(client.prefix)
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.mimetype == 'application/x-ndjson'
+
+    lines = r.get_data(as_text=True).splitlines()
+    assert [loads(line)['close'] for line in lines] == [1, 2, 3]
+    assert loads(lines[0])['date'] == '2017-01-01T00:00:00'
+
+    r = client.get(url + '?format=csv')
+    lines = r.get_data(as_text=True).splitlines()
+    assert lines[0].split(',')[-2:] == ['close', 'date']
+    assert lines[1].split(',')[-2:] == ['1.0', '2017-01-01T00:00:00']
+    assert len(lines) == 4
+
+    r = client.get(url + '?format=xml')
+    assert r.status_code == 400
@@ -6,14 +6,32 @@
     Provides unit tests for the website.
 """
 
-from json import loads, dumps
+import logging
+import sqlite3
+import subprocess
+import time
+
+from json import dump, loads, dumps
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 import pytest
 
-from app import create_app, db
+import config
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+
+from app import cache, conditional, create_app, db, frs, pool, replicas
+from app.cache import FileVersions
+from app.fetch import fetch_prices, get_providers, parse_csv
+from app.metrics import Registry, TimedQueuePool
+from app.models.hermes import Price
+from benchmarks.data import get_data
+from app.encoding import dumps as encode
 from app.helper import (
     get_table_names, get_models, process, get_init_data, gen_tables,
-    JSON, get_json)
+    populate, JSON, get_json)
 
 
 @pytest.fixture
@@ -73,3 +91,402 @@ def test_api_delete(client):
             # delete entry and test that the it was deleted
             client.delete('{}{}/1'.format(client.prefix, table))
             assert client.get_num_results(table) == old - 1
+
+
+def test_populate(client):
+    with client.application.app_context():
+        summary = list(populate(db.session, get_init_data()))
+
+    assert not any(res['errors'] for res in summary)
+
+    for res in summary:
+        r = client.get(client.prefix + res['table'])
+        assert get_json(r)['num_results'] == res['count']
+
+
+def test_swagger_json(client):
+    r = client.get('/swagger.json', headers={'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert r.headers['Content-Encoding'] == 'gzip'
+    etag = r.headers['ETag']
+
+    # test that unchanged specs are revalidated
+    headers = {'Accept-Encoding': 'gzip', 'If-None-Match': etag}
+    r = client.get('/swagger.json', headers=headers)
+    assert r.status_code == 304
+
+    # test that the identity body doesn't share the gzipped body's ETag
+    r = client.get('/swagger.json', headers={'If-None-Match': etag})
+    json = get_json(r)
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+    assert json['host'] == 'localhost'
+    assert '{}/price'.format(client.prefix) in json['paths']
+
+    # test that the cached specs are bounded
+    swagger = client.application.extensions['swagger']
+
+    for i in range(frs.MAX_HOSTS + 1):
+        client.get('/swagger.json', base_url='http://host{}'.format(i))
+
+    assert len(swagger.cache) == frs.MAX_HOSTS
+
+    # test that apps don't share specs
+    other = create_app(config_mode='Test')
+    assert other.extensions['swagger'] is not client.application.extensions[
+        'swagger']
+
+
+def test_encoder():
+    values = [
+        date(2017, 1, 2), datetime(2017, 1, 2, 3), Decimal('1.5'),
+        set([1]), (x for x in [2]), map(int, '3')]
+
+    expected = ['2017-01-02', '2017-01-02T03:00:00', '1.5', [1], [2], [3]]
+    assert loads(encode(values)) == expected
+
+
+def test_conditional_get(client, monkeypatch):
+    url = client.prefix + 'exchange'
+    client.post(url, data=dumps({'symbol': 'NYSE', 'name': 'NYSE'}),
+                content_type=JSON)
+
+    # test that `Last-Modified` isn't sent within the second of the write
+    assert 'Last-Modified' not in client.get(url).headers
+
+    clock = [time.time() + 2]
+    monkeypatch.setattr(cache, 'time', lambda: clock[0])
+    monkeypatch.setattr(conditional, 'time', lambda: clock[0])
+    etags = {}
+
+    for path in [url, url + '/1']:
+        r = client.get(path)
+        etag, modified = r.headers['ETag'], r.headers['Last-Modified']
+        etags[path] = etag
+
+        # test that unchanged resources aren't resent
+        r = client.get(path, headers={'If-None-Match': etag})
+        assert r.status_code == 304
+        assert not r.data
+
+        r = client.get(path, headers={'If-Modified-Since': modified})
+        assert r.status_code == 304
+
+    # test that updates change the validators
+    d = {'name': 'New York Stock Exchange'}
+    client.patch(url + '/1', data=dumps(d), content_type=JSON)
+
+    for path, etag in etags.items():
+        r = client.get(path, headers={'If-None-Match': etag})
+        assert r.status_code == 200
+        assert r.headers['ETag'] != etag
+
+    # test that deletes and changes to embedded rows change the validators
+    clock[0] += 2
+    r = client.get(url, headers={'If-None-Match': etag})
+    etag, modified = r.headers['ETag'], r.headers['Last-Modified']
+    client.delete(url + '/1')
+    r = client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code == 200
+
+    r = client.get(url, headers={'If-Modified-Since': modified})
+    assert r.status_code == 200
+
+    etag = r.headers['ETag']
+    d = {'name': 'Yahoo'}
+    r = client.post(
+        client.prefix + 'data_source', data=dumps(d), content_type=JSON)
+
+    assert r.status_code == 201
+    r = client.get(url, headers={'If-None-Match': etag})
+    assert r.headers['ETag'] != etag
+
+    r = client.get(url + '/9')
+    assert r.status_code == 404
+
+
+def test_response_cache(monkeypatch, tmpdir):
+    monkeypatch.setattr(config.Test, 'CACHE_TYPE', 'lru')
+    monkeypatch.setattr(config.Test, 'CACHE_VERSIONS_DIR', str(tmpdir))
+    app = create_app(config_mode='Test')
+    client = app.test_client()
+    prefix = app.config.get('API_URL_PREFIX', '')
+    url = prefix + 'exchange?results_per_page=100&page=1'
+
+    with app.app_context():
+        db.create_all()
+        list(populate(db.session, get_init_data()))
+
+    r = client.get(url)
+    exchange = get_json(r)['objects'][0]
+    etag = r.headers['ETag']
+
+    # test that responses are served from the cache
+    sql = "UPDATE exchange SET name = 'Changed' WHERE id = {}"
+
+    with app.app_context():
+        db.engine.execute(sql.format(exchange['id']))
+
+    r = client.get(prefix + 'exchange?page=1&results_per_page=100')
+    assert get_json(r)['objects'][0]['name'] == exchange['name']
+    assert r.headers['ETag'] == etag
+
+    r = client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+
+    r = client.get(url, headers={'Cache-Control': 'no-cache'})
+    assert get_json(r)['objects'][0]['name'] == 'Changed'
+
+    # test that cached responses expire
+    with app.app_context():
+        db.engine.execute(sql.replace('Changed', 'Expired').format(
+            exchange['id']))
+
+    backend = app.extensions['cache'].backend
+    assert get_json(client.get(url))['objects'][0]['name'] == 'Changed'
+
+    for key, (expires, value) in list(backend.entries.items()):
+        backend.entries[key] = (0, value)
+
+    assert get_json(client.get(url))['objects'][0]['name'] == 'Expired'
+
+    # test that the versions are namespaced by database
+    versions = app.extensions['versions']
+    assert versions.dirname.startswith(str(tmpdir))
+    assert versions.dirname.endswith(cache.get_namespace(app))
+
+    # test that commits to a dependent table invalidate the response
+    other = FileVersions(versions.dirname)
+    version = other.get(['commodity'])['commodity']
+    commodity = get_json(client.get(prefix + 'commodity/1'))
+    d = {'name': 'New Name'}
+    client.patch(prefix + 'commodity/1', data=dumps(d), content_type=JSON)
+    assert other.get(['commodity'])['commodity'] != version
+
+    json = get_json(client.get(url))
+    assert json['objects'][0]['name'] == 'Expired'
+    commodities = [
+        c for o in json['objects'] for c in o['commodities']
+        if c['id'] == commodity['id']]
+
+    assert commodities[0]['name'] == 'New Name'
+
+
+def test_server_timing(client, monkeypatch):
+    url = client.prefix + 'exchange'
+    client.post(url, data=dumps({'symbol': 'NYSE', 'name': 'NYSE'}),
+                content_type=JSON)
+
+    r = client.get(url)
+    db_timing = r.headers['Server-Timing'].split(', ')[0]
+    assert db_timing.startswith('db;dur=')
+    assert 'queries' in db_timing
+
+    # test that requests over budget are logged
+    config = client.application.config
+    config['SQL_QUERY_BUDGET'] = 0
+    messages = []
+    warning = lambda msg, *args: messages.append(msg % args)
+    monkeypatch.setattr(client.application.logger, 'warning', warning)
+    client.get(url)
+    assert messages[0].startswith('GET /{} exceeded'.format(url.lstrip('/')))
+
+
+def test_metrics(monkeypatch, tmpdir):
+    monkeypatch.setattr(config.Test, 'METRICS_DIR', str(tmpdir))
+    app = create_app(config_mode='Test')
+    client = app.test_client()
+    url = app.config.get('API_URL_PREFIX', '') + 'exchange'
+
+    with app.app_context():
+        db.create_all()
+
+    client.get(url)
+    client.get(url + '/9')
+
+    # test that the other workers' values are included
+    other = Registry(str(tmpdir), name='other')
+    labels = [('method', 'GET'), ('table', 'exchange'), ('status', 200)]
+    other.inc('http_requests_total', labels, 2)
+    other.flush()
+
+    # test that the files of exited processes are folded into one
+    process = subprocess.Popen(['true'])
+    process.wait()
+    dead = {'pid': process.pid, 'values': [], 'gauges': []}
+    dead['values'].append(['http_requests_total', labels, 1])
+
+    with open(str(tmpdir.join('{}.json'.format(process.pid))), 'w') as f:
+        dump(dead, f)
+
+    r = client.get('/metrics')
+    assert r.status_code == 200
+    lines = r.get_data(as_text=True).splitlines()
+    prefix = 'http_requests_total{method="GET",table="exchange",status="'
+    assert prefix + '200"} 4.0' in lines
+    assert not tmpdir.join('{}.json'.format(process.pid)).exists()
+    assert tmpdir.join('dead.json').exists()
+
+    r = client.get('/metrics')
+    lines = r.get_data(as_text=True).splitlines()
+    assert prefix + '200"} 4.0' in lines
+    assert prefix + '404"} 1.0' in lines
+    assert '# TYPE http_request_duration_seconds histogram' in lines
+
+    in_flight = 'http_requests_in_flight{method="GET",table="exchange"} 0.0'
+    assert in_flight in lines
+
+    names = {line.split(' ')[0].split('{')[0] for line in lines}
+    assert 'serialization_seconds_count' in names
+
+    # test that queue pools are timed (even once recreated by a dispose)
+    options = {}
+    db.apply_driver_hacks(app, make_url('postgresql://host/db'), options)
+    assert options['poolclass'] is TimedQueuePool
+
+    registry = app.extensions['metrics']
+    key = ('db_pool_checkout_wait_seconds_count', ())
+    _pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'))
+
+    with app.app_context():
+        _pool.connect().close()
+        _pool.dispose()
+        _pool = _pool.recreate()
+        _pool.connect().close()
+
+    assert registry.values[key] == 2
+
+
+def test_synthetic_data(client):
+    scale = {'commodities': 3, 'years': 0.1, 'accounts': 4}
+
+    with client.application.app_context():
+        summary = list(populate(db.session, get_data(**scale)))
+
+    assert not any(res['errors'] for res in summary)
+    r = client.get(client.prefix + 'holding/4')
+    assert get_json(r)['commodity']['symbol'].startswith('SYN')
+    r = client.get(client.prefix + 'transaction')
+    assert get_json(r)['num_results'] == 4 * 3 * 4
+
+
+def test_fetch_prices(client, monkeypatch, tmpdir):
+    app = client.application
+    monkeypatch.setitem(app.config, 'PRICE_FAKE_DIR', str(tmpdir))
+    monkeypatch.setitem(app.config, 'PRICE_FAKE_LATENCY', 0)
+    providers = get_providers(app.config, offline=True)
+    start = date(2017, 1, 1)
+    assert parse_csv('Date,Close\n2016-12-30,1.5\n2017-01-02,2', start) == [
+        ('2017-01-02', 2.0)]
+
+    # a directory can't be read, so fetching EUR raises an IOError
+    tmpdir.mkdir('EUR.csv')
+
+    with app.app_context():
+        list(populate(db.session, get_init_data()))
+
+        # test that one provider's failure doesn't stop the others
+        summary = fetch_prices(db.session, providers, 'USD', workers=4)
+        assert list(summary['errors']) == ['EUR']
+        assert summary['symbols'] == 8
+        assert summary['inserted'] == summary['fetched'] == 7 * 365
+
+        tmpdir.join('EUR.csv').remove()
+        summary = fetch_prices(db.session, providers, 'USD', workers=4)
+        assert not summary['errors']
+        assert summary['symbols'] == 1
+        assert summary['inserted'] == summary['fetched'] == 365
+
+        # test that current symbols are skipped
+        summary = fetch_prices(db.session, providers, 'USD')
+        assert summary['current'] == 8
+        assert not summary['symbols'] + summary['fetched']
+
+        # test that only the dates after the watermark are fetched
+        price = Price.query.filter_by(commodity_id=2)
+        watermark = price.order_by(Price.date.desc())[10].date
+        price.filter(Price.date > watermark).delete()
+        summary = fetch_prices(db.session, providers, 'USD')
+        assert summary['symbols'] == 1
+        assert summary['fetched'] == summary['inserted'] == 10
+
+        # test that backfills are idempotent
+        since = date.today() - timedelta(days=30)
+        summary = fetch_prices(db.session, providers, 'USD', ['EUR'], since)
+        assert summary['symbols'] == 1
+        assert summary['fetched'] == summary['skipped'] == 30
+        assert not summary['inserted']
+
+    r = client.get(client.prefix + 'price')
+    assert get_json(r)['num_results'] == 8 * 365
+
+
+def test_pool(monkeypatch):
+    monkeypatch.setattr(config.Test, 'GEVENT', True)
+    monkeypatch.setattr(config.Test, 'SQLALCHEMY_POOL_PRE_PING', True)
+    messages = []
+    warning = lambda msg, *args: messages.append(msg % args)
+    monkeypatch.setattr(logging.getLogger('app'), 'warning', warning)
+
+    # test that processes which gevent hasn't patched are left alone
+    create_app(config_mode='Test')
+    assert not messages
+
+    monkeypatch.setattr(pool, 'is_patched', lambda: True)
+    app = create_app(config_mode='Test')
+
+    # test that a blocking driver is reported
+    assert any('pysqlite driver blocks' in msg for msg in messages)
+
+    with app.app_context():
+        engine = db.get_engine(app)
+        assert event.contains(engine, 'engine_connect', pool.ping)
+        assert engine.scalar('SELECT 1') == 1
+
+
+def test_replicas(monkeypatch, tmpdir):
+    uris = ['sqlite:///{}'.format(tmpdir.join(n)) for n in ['a.db', 'b.db']]
+    monkeypatch.setattr(config.Test, 'SQLALCHEMY_DATABASE_URI', uris[0])
+    monkeypatch.setattr(config.Test, 'SQLALCHEMY_REPLICA_URIS', uris[1:])
+    monkeypatch.setattr(config.Test, 'REPLICA_LAG_TABLE', 'exchange')
+    monkeypatch.setattr(replicas.Router, 'start', lambda self: None)
+    app = create_app(config_mode='Test')
+    client = app.test_client()
+    url = app.config.get('API_URL_PREFIX', '') + 'exchange'
+    router = app.extensions['replicas']
+
+    with app.app_context():
+        db.create_all()
+        replica = db.get_engine(app, bind='replica0')
+        db.Model.metadata.create_all(replica)
+        sql = "INSERT INTO exchange VALUES (1, '{0}', '{0}', 'R', 'R')"
+        replica.execute(sql.format('2017-01-01 00:00:00.000000'))
+
+    # test that reads stay on the primary until the replicas are checked
+    assert not router.healthy
+
+    with app.app_context():
+        router.check()
+
+    def get_names():
+        return [o['name'] for o in get_json(client.get(url))['objects']]
+
+    assert get_names() == ['R']
+
+    # test that writers read from the primary
+    client.post(url, data=dumps({'symbol': 'P', 'name': 'P'}),
+                content_type=JSON)
+
+    assert get_names() == ['P']
+    client.cookie_jar.clear()
+    assert get_names() == ['R']
+
+    # test that replica responses don't get validators
+    assert 'ETag' not in client.get(url).headers
+
+    # test that lagging replicas are taken out of rotation
+    with app.app_context():
+        router.check()
+
+    assert router.healthy == []
+    assert get_names() == ['P']
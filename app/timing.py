@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    app.timing
+    ~~~~~~~~~~
+
+    Provides per request SQL instrumentation reported in `Server-Timing`
+
+    Every statement executed while handling a request is counted and timed
+    (through the engine's cursor execution events), along with the rows the
+    driver reports for it (the rows returned on PostgreSQL; SQLite doesn't
+    report the rows of a `SELECT`). Responses then carry a header like
+
+        Server-Timing: db;dur=3.2;desc="4 queries, 33 rows", app;dur=9.8
+
+    and requests exceeding `SQL_QUERY_BUDGET` statements or `SQL_TIME_BUDGET`
+    seconds of database time are logged. Streamed responses only report the
+    statements executed before streaming starts.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from timeit import default_timer as timer
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from builtins import *
+
+
+class Stats(object):
+    __slots__ = ('start', 'queries', 'rows', 'db_time')
+
+    def __init__(self):
+        self.start = timer()
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0
+
+    @property
+    def header(self):
+        desc = '{} queries, {} rows'.format(self.queries, self.rows)
+        db_dur = self.db_time * 1000
+        app_dur = (timer() - self.start) * 1000
+        return 'db;dur={:.1f};desc="{}", app;dur={:.1f}'.format(
+            db_dur, desc, app_dur)
+
+
+def get_stats():
+    return g.get('sql_stats') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, params, context, many):
+    conn.info.setdefault('query_start', []).append(timer())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, params, context, many):
+    elapsed = timer() - conn.info['query_start'].pop()
+    stats = get_stats()
+
+    if stats is not None:
+        stats.queries += 1
+        stats.rows += max(cursor.rowcount, 0)
+        stats.db_time += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    if context.connection is not None:
+        context.connection.info.pop('query_start', None)
+
+
+def start():
+    g.sql_stats = Stats()
+
+
+def finish(response):
+    stats = g.pop('sql_stats', None)
+
+    if stats is None:
+        return response
+
+    response.headers['Server-Timing'] = stats.header
+    max_queries = current_app.config.get('SQL_QUERY_BUDGET')
+    max_time = current_app.config.get('SQL_TIME_BUDGET')
+    too_many = max_queries is not None and stats.queries > max_queries
+    too_slow = max_time is not None and stats.db_time > max_time
+
+    if too_many or too_slow:
+        msg = '%s %s exceeded its SQL budget: %i queries in %.1fms'
+        db_dur = stats.db_time * 1000
+        args = (request.method, request.path, stats.queries, db_dur)
+        current_app.logger.warning(msg, *args)
+
+    return response
+
+
+def init_app(app):
+    """Reports the SQL statistics of each request if `SERVER_TIMING` is set"""
+    if app.config.get('SERVER_TIMING'):
+        app.before_request(start)
+        app.after_request(finish)
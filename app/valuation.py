@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    app.valuation
+    ~~~~~~~~~~~~~
+
+    Provides holding valuation for accounts and people
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+from flask import jsonify, request, Blueprint
+from sqlalchemy import case, func, select
+
+from app.fx import get_graph
+from app.helper import error
+from app.history import get_commodity_id
+from app.lots import query_basis
+from app.series import get_series
+from builtins import *
+
+
+def query_positions(session, person_id=None, account_id=None):
+    """Returns a query of the net shares of each holding.
+
+    Buy transactions add shares and Sell transactions remove them. The netting
+    is done by the database in a single grouped pass over all holdings of the
+    person (or account).
+    """
+    from app.models.cronus import Account, Holding, Transaction, TrxnType
+
+    signed = case(
+        [(TrxnType.name == 'Buy', Transaction.shares),
+         (TrxnType.name == 'Sell', -Transaction.shares)], else_=0)
+
+    columns = [
+        Holding.id.label('holding_id'), Holding.account_id,
+        Holding.commodity_id, Account.currency_id]
+
+    shares = func.coalesce(func.sum(signed), 0).label('shares')
+    query = session.query(*(columns + [shares]))
+    query = query.join(Account, Holding.account_id == Account.id)
+    query = query.outerjoin(Transaction, Transaction.holding_id == Holding.id)
+    query = query.outerjoin(TrxnType, Transaction.type_id == TrxnType.id)
+
+    if person_id is not None:
+        query = query.filter(Account.owner_id == person_id)
+
+    if account_id is not None:
+        query = query.filter(Holding.account_id == account_id)
+
+    return query.group_by(*columns).order_by(Holding.id)
+
+
+def value_holdings(session, person_id=None, account_id=None):
+    """Values each holding at its latest price in its account's currency.
+
+    Runs two queries regardless of the number of holdings or transactions
+    (positions and cost basis, read from the lots table). The latest prices
+    are read from the price series cache (see `app.series`), which only
+    queries the series it doesn't hold. Holdings without a price have a
+    `value` of `None`.
+    """
+    positions = query_positions(session, person_id, account_id)
+    holding_ids = select([positions.subquery().c.holding_id])
+    bases = dict((r[0], r[2:]) for r in query_basis(session, holding_ids))
+    holdings = [row._asdict() for row in positions]
+    keys = [(h['commodity_id'], h['currency_id']) for h in holdings]
+    series = dict((key, get_series(*key)) for key in set(keys))
+    quotes = [(series[key].latest, series[key].last_date) for key in keys]
+
+    for holding, (close, date) in zip(holdings, quotes):
+        cost, realized = bases.get(holding['holding_id'], (0, 0))
+        value = None if close is None else holding['shares'] * close
+        holding.update({
+            'price': close, 'value': value, 'cost_basis': cost,
+            'price_date': date.isoformat() if date else None,
+            'realized_gain': realized,
+            'unrealized_gain': None if value is None else value - cost})
+
+    return holdings
+
+
+def get_totals(holdings):
+    totals = {}
+
+    for holding in holdings:
+        if holding['value'] is not None:
+            currency_id = holding['currency_id']
+            totals[currency_id] = totals.get(currency_id, 0) + holding['value']
+
+    return [{'currency_id': k, 'value': v} for k, v in sorted(totals.items())]
+
+
+def convert_holdings(holdings, graph, currency_id):
+    """Adds each holding's value in `currency_id` as its `target_value`"""
+    values = [h['value'] for h in holdings]
+    sources = [h['currency_id'] for h in holdings]
+    converted = graph.convert(values, sources, currency_id)
+
+    for holding, value in zip(holdings, converted):
+        holding['target_value'] = value
+
+    return holdings
+
+
+def create_blueprint(db, **kwargs):
+    """Creates a blueprint exposing the `GET /person/<id>/valuation` and
+    `GET /account/<id>/valuation` endpoints.
+
+    Both accept an optional target `currency` (symbol) or `currency_id` in
+    which to also express each holding's value and the totals. The
+    `target_total` is `null` if any of the `num_unconverted` (valued) holdings
+    has no rate to the target currency.
+    """
+    from app.models.cronus import Account, Person
+
+    blueprint = Blueprint('valuation', __name__)
+    prefix = kwargs.get('url_prefix', '')
+
+    def add_route(table):
+        name = table.__tablename__
+        path = '{0}/{1}/<int:{1}_id>/valuation'.format(prefix, name)
+        endpoint = '{}_valuation'.format(name)
+
+        def valuation(**kwargs):
+            _id = kwargs['{}_id'.format(name)]
+
+            symbol, currency_id = map(
+                request.args.get, ['currency', 'currency_id'])
+
+            try:
+                target = get_commodity_id(db.session, symbol, currency_id)
+            except (ValueError, TypeError, OverflowError):
+                return error('Unable to construct query')
+
+            if not db.session.query(table.id).filter(table.id == _id).count():
+                return error('No result found', 404)
+            elif (symbol or currency_id) and not target:
+                return error('No result found', 404)
+
+            holdings = value_holdings(db.session, **kwargs)
+            result = dict(kwargs)
+            result.update({
+                'num_results': len(holdings), 'objects': holdings,
+                'totals': get_totals(holdings)})
+
+            if target:
+                convert_holdings(holdings, get_graph(), target)
+                valued = [h for h in holdings if h['value'] is not None]
+                values = [h['target_value'] for h in valued]
+                unconverted = values.count(None)
+                total = None if unconverted else sum(values)
+                result['target_currency_id'] = target
+                result['target_total'] = total
+                result['num_unconverted'] = unconverted
+
+            return jsonify(result)
+
+        blueprint.add_url_rule(path, endpoint, valuation)
+
+    for table in [Person, Account]:
+        add_route(table)
+
+    return blueprint
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks
+    ~~~~~~~~~~
+
+    Provides micro-benchmarks of performance sensitive code paths
+"""
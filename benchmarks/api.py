@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.api
+    ~~~~~~~~~~~~~~
+
+    Provides timings of the hot API endpoints
+
+    Each case is requested `repeat` times through the app's test client (so
+    network time isn't included) with `Cache-Control: no-cache` (so the
+    response cache is bypassed). Its status, SQL statement count (from the
+    `Server-Timing` header), and min, median, mean and max milliseconds are
+    reported. Results are compared by case name, so runs of different
+    revisions (at the same scale) can be diffed. Run with `manage bench`.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import platform
+import re
+
+from datetime import date, datetime as dt, timedelta
+from json import dumps
+from timeit import default_timer as timer
+
+from werkzeug.urls import url_quote
+
+from benchmarks.data import NUM_INIT_COMMODITIES, USD_ID
+from builtins import *
+
+DEF_REPEAT = 20
+DEF_THRESHOLD = 1.2
+DEF_MIN_DELTA = 1  # ms, so that noise in the fastest cases isn't flagged
+QUERIES_REGEX = re.compile(r'(\d+) queries')
+HEADERS = {'Cache-Control': 'no-cache', 'Content-Type': 'application/json'}
+
+
+def get_filter(commodity_id, since=None):
+    filters = [{'name': 'commodity_id', 'op': 'eq', 'val': commodity_id}]
+
+    if since:
+        filters.append({'name': 'date', 'op': 'ge', 'val': since})
+
+    return {'filters': filters}
+
+
+def gen_posts(commodity_id):
+    """Yields price bodies with consecutive (so unique) dates"""
+    day = date(2030, 1, 1)
+
+    while True:
+        day += timedelta(days=1)
+
+        yield {
+            'commodity_id': commodity_id, 'currency_id': USD_ID,
+            'close': 100, 'date': day.isoformat()}
+
+
+def gen_patches(commodity_id):
+    """Yields bodies patching the closes of a commodity's prices"""
+    q = get_filter(commodity_id)
+    close = 100
+
+    while True:
+        close += 1
+        yield {'q': q, 'close': close}
+
+
+def get_cases(prefix='', commodity_id=NUM_INIT_COMMODITIES + 1):
+    """Returns a list of (name, method, path, body generator) tuples"""
+    q = url_quote(dumps(get_filter(commodity_id, '2016-01-01')))
+    price = '{}/price'.format(prefix)
+    commodity = '{}/commodity'.format(prefix)
+
+    return [
+        ('list price', 'GET', price, None),
+        ('list price (page 100)', 'GET', price + '?page=100', None),
+        ('list price (cursor)', 'GET', price + '?cursor=', None),
+        ('filter price', 'GET', '{}?q={}'.format(price, q), None),
+        ('list commodity (joins)', 'GET', commodity, None),
+        ('get commodity', 'GET', '{}/{}'.format(commodity, commodity_id), None),
+        ('post price', 'POST', price, gen_posts(commodity_id)),
+        ('patch many price', 'PATCH', price, gen_patches(commodity_id)),
+        ('swagger.json', 'GET', '{}/swagger.json'.format(prefix), None)]
+
+
+def get_queries(response):
+    match = QUERIES_REGEX.search(response.headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def time_case(client, method, path, bodies=None, repeat=DEF_REPEAT):
+    """Returns the stats of requesting `path` `repeat` times"""
+    times = []
+
+    for _ in range(repeat):
+        data = dumps(next(bodies)) if bodies else None
+        start = timer()
+        r = client.open(path, method=method, data=data, headers=HEADERS)
+        times.append((timer() - start) * 1000)
+
+    times.sort()
+
+    return {
+        'status': r.status_code, 'queries': get_queries(r), 'runs': repeat,
+        'min_ms': times[0], 'median_ms': times[len(times) // 2],
+        'mean_ms': sum(times) / repeat, 'max_ms': times[-1]}
+
+
+def run(app, repeat=DEF_REPEAT, scale=None):
+    """Returns the timings of each case along with the run's metadata"""
+    client = app.test_client()
+    prefix = app.config.get('API_URL_PREFIX', '')
+    results = []
+
+    for name, method, path, bodies in get_cases(prefix):
+        result = time_case(client, method, path, bodies, repeat)
+        results.append(dict(result, name=name, method=method, path=path))
+
+    meta = {
+        'timestamp': dt.utcnow().isoformat(), 'scale': scale or {},
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'python': platform.python_version()}
+
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new, threshold=DEF_THRESHOLD, min_delta=DEF_MIN_DELTA):
+    """Yields (name, old ms, new ms, ratio, regressed) tuples comparing the
+    median times of the cases in both runs
+    """
+    medians = dict((r['name'], r['median_ms']) for r in old['results'])
+
+    for result in new['results']:
+        name, new_ms = result['name'], result['median_ms']
+
+        if name in medians:
+            old_ms = medians[name]
+            ratio = new_ms / old_ms if old_ms else float('inf')
+            regressed = ratio > threshold and new_ms - old_ms > min_delta
+            yield (name, old_ms, new_ms, ratio, regressed)
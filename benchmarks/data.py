@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.data
+    ~~~~~~~~~~~~~~~
+
+    Provides a synthetic dataset which scales with the number of commodities,
+    years of prices, and accounts
+
+    The data extends `app.helper.get_init_data()` and is generated in the same
+    form, so it's loaded with `app.helper.populate`. It assumes a freshly
+    initialized database, i.e., that ids are assigned in insertion order.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import random
+
+from datetime import date, timedelta
+
+from app.helper import get_init_data
+from builtins import *
+
+# ids of `get_init_data()` rows
+USD_ID, STOCK_TYPE_ID, SOURCE_ID, EXCHANGE_ID, OWNER_ID = 1, 1, 1, 1, 1
+COMPANY_IDS, ACCOUNT_TYPE_IDS = [1, 2], [1, 2]
+DIVIDEND_ID, SPLIT_ID, BUY_ID, SELL_ID = 1, 3, 1, 2
+NUM_INIT_COMMODITIES = 9
+NUM_INIT_ACCOUNTS = 2
+NUM_INIT_HOLDINGS = 3
+
+
+def gen_days(years, end=None):
+    """Yields the weekdays of the `years` years ending on `end`"""
+    end = end or date(2017, 1, 1)
+    day = end - timedelta(days=int(365.25 * years))
+
+    while day < end:
+        if day.weekday() < 5:
+            yield day
+
+        day += timedelta(days=1)
+
+
+def gen_prices(commodity_id, days, rand):
+    """Yields the daily closes of a random walk"""
+    close = rand.uniform(10, 200)
+
+    for day in days:
+        close = max(close * rand.gauss(1, 0.015), 0.01)
+
+        yield {
+            'commodity_id': commodity_id, 'currency_id': USD_ID,
+            'close': round(close, 2), 'date': day.isoformat()}
+
+
+def gen_events(commodity_id, days, rand):
+    """Yields quarterly dividends and the occasional stock split"""
+    for pos, day in enumerate(days):
+        if pos % 63 == 62:
+            value, type_id = round(rand.uniform(0.1, 1), 2), DIVIDEND_ID
+        elif pos % 250 == 249 and rand.random() < 0.2:
+            value, type_id = 2, SPLIT_ID
+        else:
+            continue
+
+        yield {
+            'commodity_id': commodity_id, 'currency_id': USD_ID,
+            'type_id': type_id, 'value': value, 'date': day.isoformat()}
+
+
+def gen_transactions(holding_id, days, num, rand):
+    """Yields `num` buys followed by a sale of part of the position"""
+    dates = sorted(rand.sample(days, min(num, len(days))))
+    shares = 0
+
+    for pos, day in enumerate(dates):
+        if shares and pos == len(dates) - 1:
+            type_id = SELL_ID
+            amount = max(1, int(shares * rand.uniform(0.1, 0.9)))
+            shares -= amount
+        else:
+            type_id, amount = BUY_ID, rand.randint(1, 100)
+            shares += amount
+
+        yield {
+            'type_id': type_id, 'holding_id': holding_id, 'shares': amount,
+            'price': round(rand.uniform(10, 200), 2),
+            'date': day.isoformat(), 'commissionable': True}
+
+
+def get_data(commodities=20, years=2, accounts=1000, holdings=3,
+             transactions=4, seed=0):
+    """Returns `get_init_data()` plus `commodities` stocks with `years` of
+    daily prices and events, and `accounts` accounts of `holdings` holdings
+    of `transactions` transactions each
+    """
+    rand = random.Random(seed)
+    days = list(gen_days(years))
+    first_id = NUM_INIT_COMMODITIES + 1
+    commodity_ids = list(range(first_id, first_id + commodities))
+    holdings = min(holdings, commodities)
+
+    commodity_rows = [
+        {
+            'type_id': STOCK_TYPE_ID, 'data_source_id': SOURCE_ID,
+            'exchange_id': EXCHANGE_ID, 'symbol': 'SYN{:05d}'.format(pos),
+            'name': 'Synthetic {}'.format(pos)}
+        for pos in range(commodities)]
+
+    price_rows, event_rows = [], []
+
+    for commodity_id in commodity_ids:
+        price_rows.extend(gen_prices(commodity_id, days, rand))
+        event_rows.extend(gen_events(commodity_id, days, rand))
+
+    account_rows = [
+        {
+            'type_id': rand.choice(ACCOUNT_TYPE_IDS),
+            'company_id': rand.choice(COMPANY_IDS), 'currency_id': USD_ID,
+            'owner_id': OWNER_ID, 'name': 'Account {}'.format(pos)}
+        for pos in range(accounts)]
+
+    holding_rows, trxn_rows = [], []
+    first_id = NUM_INIT_ACCOUNTS + 1
+
+    for account_id in range(first_id, first_id + accounts):
+        for commodity_id in rand.sample(commodity_ids, holdings):
+            holding_rows.append({
+                'account_id': account_id, 'commodity_id': commodity_id})
+
+            holding_id = len(holding_rows) + NUM_INIT_HOLDINGS
+            trxn_rows.extend(
+                gen_transactions(holding_id, days, transactions, rand))
+
+    return get_init_data() + [
+        {'commodity': commodity_rows},
+        {'price': price_rows, 'event': event_rows, 'account': account_rows},
+        {'holding': holding_rows},
+        {'transaction': trxn_rows}]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.encoding
+    ~~~~~~~~~~~~~~~~~~~
+
+    Provides a micro-benchmark of encoding `Price` rows as json
+
+    Run with `python -m benchmarks.encoding`
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import json
+
+from datetime import datetime as dt, timedelta
+from decimal import Decimal
+from timeit import repeat
+
+from app.encoding import APIEncoder, dumps
+from builtins import *
+
+NUM_ROWS = 1000
+
+
+class LegacyEncoder(json.JSONEncoder):
+    """The encoder `app.CustomEncoder` used to be"""
+    def default(self, obj):
+        if set(['quantize', 'year']).intersection(dir(obj)):
+            return str(obj)
+        elif set(['next', 'union']).intersection(dir(obj)):
+            return list(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def gen_prices(num=NUM_ROWS):
+    start = dt(2017, 1, 1)
+
+    for pos in range(num):
+        date = start + timedelta(days=pos)
+
+        yield {
+            'id': pos + 1, 'commodity_id': 6, 'currency_id': 1,
+            'close': Decimal('100.25') + pos, 'date': date,
+            'utc_created': date, 'utc_updated': date}
+
+
+def time_func(func, number=20):
+    """Returns the best time (in milliseconds) of calling `func`"""
+    return min(repeat(func, number=number, repeat=3)) * 1000 / number
+
+
+def run(num=NUM_ROWS):
+    """Returns the time to encode `num` rows with the legacy encoder, the
+    type-dispatched encoder, and the type-dispatched encoder using the
+    preferred json backend (`app.encoding.dumps`)
+    """
+    rows = list(gen_prices(num))
+    encoders = [
+        ('legacy', lambda: json.dumps(rows, cls=LegacyEncoder)),
+        ('legacy (indented)', lambda: json.dumps(
+            rows, cls=LegacyEncoder, indent=2)),
+        ('dispatch', lambda: json.dumps(rows, cls=APIEncoder)),
+        ('dispatch (indented)', lambda: json.dumps(
+            rows, cls=APIEncoder, indent=2)),
+        ('dispatch (backend)', lambda: dumps(rows))]
+
+    return [(name, time_func(func)) for name, func in encoders]
+
+
+if __name__ == '__main__':
+    print('ms per {} Price rows'.format(NUM_ROWS))
+
+    for name, elapsed in run():
+        print('{:>20}: {:.2f}'.format(name, elapsed))
@@ -10,6 +10,8 @@
     ###########################################################################
 """
 from os import getenv, path as p
+from tempfile import gettempdir
+
 from pkutils import parse_module
 
 PARENT_DIR = p.abspath(p.dirname(__file__))
@@ -28,6 +30,16 @@ class Config(object):
     TESTING = False
     DEBUG_MEMCACHE = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_POOL_PRE_PING = False
+    GEVENT = False
+
+    # comma separated read replica urls (see `app.replicas`)
+    replicas = getenv('REPLICA_URLS', '')
+    SQLALCHEMY_REPLICA_URIS = [r for r in replicas.split(',') if r]
+    REPLICA_MAX_LAG = 30
+    REPLICA_CHECK_INTERVAL = 10
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_LAG_TABLE = 'price'
     ADMINS = frozenset([__EMAIL__])
     HOST = '127.0.0.1'
 
@@ -47,6 +59,68 @@ class Config(object):
     API_RESULTS_PER_PAGE = 32
     API_MAX_RESULTS_PER_PAGE = 1024
     API_URL_PREFIX = ''
+
+    # indenting forces the json module onto its pure python encoder
+    JSONIFY_PRETTYPRINT_REGULAR = False
+    # default `include` of list calls by table, e.g., {'price': []}
+    API_INCLUDES = {}
+
+    # `cursor` pagination ordering by table (defaults to ['id'])
+    API_KEYSETS = {
+        'price': ['date', 'id'], 'event': ['date', 'id'],
+        'transaction': ['date', 'id']}
+
+    # list call count mode by table (see `app.counts`)
+    API_COUNT_MODE = 'exact'
+    API_COUNT_MODES = {'price': 'cached'}
+    API_COUNT_TTL = 60
+    API_COUNT_MAX_ENTRIES = 1024
+    API_BULK_TABLES = ['price', 'event']
+    API_BULK_CHUNK_SIZE = 1000
+    API_EXPORT_CHUNK_SIZE = 1000
+    API_READONLY_TABLES = ['lot', 'adjustment']
+    SERIES_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+    # seconds until the series and fx rates caches see other processes'
+    # writes (their own are applied on commit)
+    SERIES_CACHE_TTL = 300
+    FX_CACHE_TTL = 300
+    LOT_METHOD = 'fifo'
+
+    # GET response cache type ('memcached', 'lru' or None) (see `app.cache`)
+    servers = getenv('MEMCACHE_SERVERS', '')
+    MEMCACHE_SERVERS = [s for s in servers.split(',') if s]
+    CACHE_TYPE = 'memcached' if MEMCACHE_SERVERS else 'lru'
+    CACHE_MAX_ENTRIES = 1024
+    CACHE_TIMEOUT = 300
+    versions = '{}-versions'.format(__APP_NAME__)
+    CACHE_VERSIONS_DIR = p.join(gettempdir(), versions)
+
+    # per request SQL stats in `Server-Timing` (see `app.timing`), requests
+    # over either budget (None to disable) are logged
+    SERVER_TIMING = True
+    SQL_QUERY_BUDGET = 50
+    SQL_TIME_BUDGET = 0.5
+
+    # `/metrics` storage shared by the workers (see `app.metrics`)
+    METRICS_DIR = p.join(gettempdir(), '{}-metrics'.format(__APP_NAME__))
+    METRICS_FLUSH_INTERVAL = 1
+
+    # price providers by data source name (see `app.fetch`), urls are
+    # formatted with `symbol`, `currency` and `start` and return csv
+    PRICE_SOURCES = {
+        'Yahoo': {'url': getenv('YAHOO_PRICE_URL'), 'rate': 5},
+        'Google': {'url': getenv('GOOGLE_PRICE_URL'), 'rate': 5},
+        'XE': {'url': getenv('XE_PRICE_URL'), 'rate': 1}}
+
+    PRICE_CURRENCY = 'USD'
+    PRICE_WORKERS = 8
+    PRICE_TIMEOUT = 10
+    PRICE_RETRIES = 3
+    PRICE_CHUNK_SIZE = 1000
+    PRICE_FAKE_DIR = p.join(gettempdir(), '{}-prices'.format(__APP_NAME__))
+    PRICE_FAKE_LATENCY = 0.05
+
     SWAGGER_URL = ''
     SWAGGER_EXCLUDE_COLUMNS = ['utc_created', 'utc_updated']
 
@@ -63,6 +137,15 @@ class Production(Config):
     SQLALCHEMY_DATABASE_URI = getenv('DATABASE_URL', defaultdb)
     HOST = '0.0.0.0'
 
+    # `-k gevent` workers (see `app.pool`), the pool is shared by each
+    # worker's greenlets (so it bounds the worker's concurrent queries)
+    GEVENT = True
+    SQLALCHEMY_POOL_SIZE = int(getenv('DB_POOL_SIZE', 10))
+    SQLALCHEMY_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 10))
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+
 
 class Development(Config):
     base = 'sqlite:///{}?check_same_thread=False'
@@ -76,3 +159,5 @@ class Test(Config):
     DEBUG = True
     TESTING = True
     DEBUG_MEMCACHE = False
+    CACHE_TYPE = None
+    METRICS_DIR = None
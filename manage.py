@@ -7,8 +7,13 @@ from __future__ import (
     absolute_import, division, print_function, with_statement,
     unicode_literals)
 
+import sys
+
+from datetime import datetime as dt
+from json import dump, dumps, load
 from os import path as p
 from subprocess import call, check_call, CalledProcessError
+from timeit import default_timer as timer
 
 try:
     from urllib.parse import urlsplit
@@ -16,7 +21,11 @@ except ImportError:
     from urlparse import urlsplit
 
 from app import create_app, db, helper
+from app.export import gen_export
+from app.fetch import fetch_prices, get_providers
 from app.helper import DEF_PORT
+from benchmarks import api as bench_api
+from benchmarks.data import get_data
 from flask import current_app as app
 from flask_script import Server, Manager
 
@@ -159,20 +168,156 @@ def initdb():
 
 
 @manager.option('-p', '--port', help='The server port', default=DEF_PORT)
-def popdb(port):
+@manager.option(
+    '-s', '--server', help='Post each row to a running server',
+    action='store_true')
+@manager.option('-c', '--chunksize', help='Rows per insert', type=int)
+def popdb(port, server=False, chunksize=None):
     """Populates the database with sample data"""
     with app.app_context():
         initdb()
         raw = helper.get_init_data()
 
-        for piece in helper.process(raw):
-            for data in piece['data']:
-                r = helper.post(piece['table'], data=data, port=port)
-                print(r.status_code if r.ok else r.json()['message'])
+        if server:
+            for piece in helper.process(raw):
+                for data in piece['data']:
+                    r = helper.post(piece['table'], data=data, port=port)
+                    print(r.status_code if r.ok else r.json()['message'])
+        else:
+            chunk_size = chunksize or app.config['API_BULK_CHUNK_SIZE']
+            start = timer()
+
+            for res in helper.populate(db.session, raw, chunk_size):
+                msg = '{table}: {count} rows in {elapsed:.3f}s'
+                print(msg.format(**res))
+
+                for error in res['errors']:
+                    print('  row {index}: {validation_errors}'.format(**error))
+
+            print('Total: {:.3f}s'.format(timer() - start))
 
     print('Database populated')
 
 
+@manager.option('-t', '--table', help='The table to export', required=True)
+@manager.option(
+    '-F', '--format', help='The export format', dest='fmt', default='ndjson',
+    choices=['ndjson', 'csv'])
+@manager.option('-o', '--output', help='The output file (default: stdout)')
+@manager.option('-c', '--chunksize', help='Rows per fetch', type=int)
+def export(table, fmt='ndjson', output=None, chunksize=None):
+    """Exports a table as NDJSON or CSV"""
+    with app.app_context():
+        tables = helper.get_tables()
+
+        if table not in tables:
+            msg = 'Unknown table {}. Available tables: {}'
+            print(msg.format(table, ', '.join(sorted(tables))), file=sys.stderr)
+            exit(1)
+
+        chunk_size = chunksize or app.config['API_EXPORT_CHUNK_SIZE']
+        chunks = gen_export(db.session, tables[table], fmt, chunk_size)
+
+        if output:
+            with open(output, 'w') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+
+
+@manager.option('-o', '--offline', help='Offline mode', action='store_true')
+@manager.option('-s', '--symbols', help='Comma separated symbols to fetch')
+@manager.option(
+    '-S', '--since', help='Backfill from this date (ignoring watermarks)')
+@manager.option('-w', '--workers', help='Concurrent fetches', type=int)
+@manager.option('-T', '--timeout', help='Fetch timeout', type=int)
+@manager.option('-c', '--chunksize', help='Rows per insert', type=int)
+def syncprices(offline=False, symbols=None, since=None, workers=None,
+               timeout=None, chunksize=None):
+    """Fetches the new prices of every commodity from its data source"""
+    with app.app_context():
+        config = app.config
+
+        if timeout:
+            config = dict(config, PRICE_TIMEOUT=timeout)
+
+        kwargs = {
+            'symbols': symbols.split(',') if symbols else None,
+            'since': dt.strptime(since, '%Y-%m-%d').date() if since else None,
+            'workers': workers or config['PRICE_WORKERS'],
+            'chunk_size': chunksize or config['PRICE_CHUNK_SIZE'],
+            'retries': config['PRICE_RETRIES']}
+
+        providers = get_providers(config, offline)
+        summary = fetch_prices(
+            db.session, providers, config['PRICE_CURRENCY'], **kwargs)
+
+        for symbol, error in sorted(summary['errors'].items()):
+            print('{}: {}'.format(symbol, error), file=sys.stderr)
+
+        msg = (
+            'Fetched {fetched} prices of {symbols} symbols in {elapsed:.3f}s '
+            '({current} current, {inserted} inserted, {skipped} skipped, '
+            '{failed} failed)')
+
+        print(msg.format(failed=len(summary['errors']), **summary))
+
+
+@manager.option(
+    '-n', '--commodities', help='Number of commodities', type=int, default=20)
+@manager.option(
+    '-y', '--years', help='Years of daily prices', type=float, default=2)
+@manager.option(
+    '-a', '--accounts', help='Number of accounts', type=int, default=1000)
+@manager.option('-s', '--seed', help='The random seed', type=int, default=0)
+@manager.option(
+    '-r', '--repeat', help='Requests per endpoint', type=int,
+    default=bench_api.DEF_REPEAT)
+@manager.option('-o', '--output', help='The results file (default: stdout)')
+@manager.option('-C', '--compare', help='Previous results to compare with')
+@manager.option(
+    '-S', '--skipload', help="Don't (re)load the synthetic data",
+    action='store_true')
+def bench(commodities, years, accounts, seed, repeat, output=None,
+          compare=None, skipload=False):
+    """Loads synthetic data (replacing all content) and times the API"""
+    scale = {
+        'commodities': commodities, 'years': years, 'accounts': accounts,
+        'seed': seed}
+
+    with app.app_context():
+        if not skipload:
+            db.drop_all()
+            db.create_all()
+            raw = get_data(**scale)
+            chunk_size = app.config['API_BULK_CHUNK_SIZE']
+
+            for res in helper.populate(db.session, raw, chunk_size):
+                msg = '{table}: {count} rows in {elapsed:.3f}s'
+                print(msg.format(**res), file=sys.stderr)
+
+        results = bench_api.run(app, repeat, scale)
+
+    if output:
+        with open(output, 'w') as f:
+            dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(dumps(results, indent=2, sort_keys=True))
+
+    if compare:
+        with open(compare) as f:
+            rows = list(bench_api.compare(load(f), results))
+
+        for name, old_ms, new_ms, ratio, regressed in rows:
+            flag = ' REGRESSION' if regressed else ''
+            msg = '{:<24} {:>9.2f}ms {:>9.2f}ms {:>6.2f}x{}'
+            line = msg.format(name, old_ms, new_ms, ratio, flag)
+            print(line, file=sys.stderr)
+
+        exit(any(row[-1] for row in rows))
+
+
 @manager.option('-r', '--remote', help='the heroku branch', default='staging')
 def add_keys(remote):
     """Deploy staging app"""
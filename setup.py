@@ -49,7 +49,7 @@ setup(
     author_email=module.__email__,
     url=pkutils.get_url(project, user),
     download_url=pkutils.get_dl_url(project, user, version),
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     package_data={
         'data': ['data/*'],